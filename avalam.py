@@ -17,10 +17,185 @@ You should have received a copy of the GNU General Public License
 along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 """
+import random
 
 PLAYER1 = 1
 PLAYER2 = -1
 
+# offsets (di, dj) of the 8 neighbours of a cell, in scan order
+DIRECTIONS = ((-1, -1), (-1, 0), (-1, 1),
+              ( 0, -1),          ( 0, 1),
+              ( 1, -1), ( 1, 0), ( 1, 1))
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def _popcount(x):
+        return bin(x).count("1")
+
+
+def _bits(x):
+    """Yield the indices of the bits set in x, in increasing order."""
+    while x:
+        low = x & -x
+        yield low.bit_length() - 1
+        x ^= low
+
+
+# transforms of a grid of n rows and m columns, as functions (i, j, n, m)
+# giving the image of cell (i, j); the last four need a square grid
+TRANSFORMS = ((lambda i, j, n, m: (i, j)),
+              (lambda i, j, n, m: (n - 1 - i, m - 1 - j)),
+              (lambda i, j, n, m: (i, m - 1 - j)),
+              (lambda i, j, n, m: (n - 1 - i, j)),
+              (lambda i, j, n, m: (j, i)),
+              (lambda i, j, n, m: (m - 1 - j, n - 1 - i)),
+              (lambda i, j, n, m: (j, n - 1 - i)),
+              (lambda i, j, n, m: (m - 1 - j, i)))
+
+# Zobrist key of the side to move (see Board.get_hash)
+ZOBRIST_SIDE = random.Random(0).getrandbits(64)
+
+_zobrist_tables = {}
+
+def _get_zobrist(cells, top):
+    """Return the Zobrist keys for a board of cells cells and towers of
+    height at most top.
+
+    The key of a tower of signed height x on cell c is table[c][x + top].
+    The keys are pseudo-random but fixed, so that they are the same in all
+    processes.
+
+    """
+    table = _zobrist_tables.get((cells, top))
+    if table is None:
+        rng = random.Random(cells * 100 + top)
+        table = [[rng.getrandbits(64) if x != top else 0
+                  for x in range(2 * top + 1)]
+                 for c in range(cells)]
+        _zobrist_tables[(cells, top)] = table
+    return table
+
+
+class Layout:
+
+    """Precomputed tables for a board layout.
+
+    A layout is a board shape together with a set of playable cells, i.e. of
+    cells that may hold a tower.  Cell (i, j) has index i*columns + j, which
+    is also its bit in the masks.  Layouts are built once by _get_layout and
+    shared by all the boards using them.
+
+    Attributes:
+    rows, columns -- shape of the board
+    top -- maximal height of a tower
+    playable -- mask of the playable cells
+    cells -- tuple of the indices of the playable cells
+    coords -- list giving the coordinates (i, j) of each cell index
+    neighbours -- list giving, for each playable cell, the tuple of its
+        playable neighbours in scan order
+    neighbour_masks -- list giving the mask of the neighbours of each cell
+    moves -- list giving, for each cell, a dictionary mapping each of its
+        neighbours to the action moving the cell on that neighbour
+    zobrist -- Zobrist keys: the key of a tower of signed height x on cell c
+        is zobrist[c][x + top]
+    symmetries -- tuple of the symmetries of the layout, i.e. of the
+        transforms of the grid mapping the playable cells onto themselves,
+        the identity first; each one is a tuple giving the image of every
+        cell index
+    inverses -- list giving the index of the inverse of each symmetry
+    symmetric_zobrist -- list giving, for each symmetry s but the identity,
+        the Zobrist keys of the cells as seen through s: the key of a tower
+        of signed height x on cell c is zobrist[symmetries[s][c]][x + top]
+
+    Actions are also encoded as integers: the action moving cell c in
+    direction DIRECTIONS[d] has code 8*c + d (see encode_action).
+
+    """
+
+    def __init__(self, rows, columns, top, playable):
+        self.rows = rows
+        self.columns = columns
+        self.top = top
+        self.playable = playable
+        self.cells = tuple(_bits(playable))
+        self.coords = [divmod(c, columns) for c in range(rows * columns)]
+        self.neighbours = [()] * (rows * columns)
+        self.neighbour_masks = [0] * (rows * columns)
+        self.moves = [{} for c in range(rows * columns)]
+        self.codes = {}
+        for c in self.cells:
+            i, j = self.coords[c]
+            neighbours = []
+            for d, (di, dj) in enumerate(DIRECTIONS):
+                if 0 <= i + di < rows and 0 <= j + dj < columns:
+                    n = c + di * columns + dj
+                    if playable >> n & 1:
+                        neighbours.append(n)
+                        action = (i, j, i + di, j + dj)
+                        self.moves[c][n] = action
+                        self.codes[action] = 8 * c + d
+            self.neighbours[c] = tuple(neighbours)
+            for n in neighbours:
+                self.neighbour_masks[c] |= 1 << n
+        self.zobrist = _get_zobrist(rows * columns, top)
+        transforms = TRANSFORMS if rows == columns else TRANSFORMS[:4]
+        symmetries = []
+        for f in transforms:
+            image = tuple(f(i, j, rows, columns) for i, j in self.coords)
+            image = tuple(i * columns + j for i, j in image)
+            if all(playable >> image[c] & 1 for c in self.cells) and \
+                    image not in symmetries:
+                symmetries.append(image)
+        self.symmetries = tuple(symmetries)
+        self.inverses = []
+        for image in symmetries:
+            inverse = [0] * len(image)
+            for c, n in enumerate(image):
+                inverse[n] = c
+            self.inverses.append(symmetries.index(tuple(inverse)))
+        self.symmetric_zobrist = [[self.zobrist[n] for n in image]
+                                  for image in symmetries[1:]]
+
+    def encode_action(self, action):
+        """Return the code of an action between two playable cells."""
+        return self.codes[tuple(action)]
+
+    def decode_action(self, code):
+        """Return the action corresponding to a code."""
+        c, d = divmod(code, 8)
+        i, j = self.coords[c]
+        di, dj = DIRECTIONS[d]
+        return (i, j, i + di, j + dj)
+
+    def transform_action(self, s, action):
+        """Return the image of an action by symmetry s."""
+        i1, j1, i2, j2 = action
+        image = self.symmetries[s]
+        i1, j1 = self.coords[image[i1 * self.columns + j1]]
+        i2, j2 = self.coords[image[i2 * self.columns + j2]]
+        return (i1, j1, i2, j2)
+
+
+_layouts = {}
+
+def _get_layout(rows, columns, top, occupied):
+    """Return a layout for a board whose towers are in mask occupied.
+
+    An existing layout of the same shape is reused if its playable cells
+    contain the towers, which is always the case for boards reached from a
+    board having this layout since towers never move to empty cells.
+
+    """
+    layouts = _layouts.setdefault((rows, columns, top), [])
+    for layout in layouts:
+        if occupied & ~layout.playable == 0:
+            return layout
+    layout = Layout(rows, columns, top, occupied)
+    layouts.append(layout)
+    return layout
+
+
 class InvalidAction(Exception):
 
     """Raised when an invalid action is played."""
@@ -29,6 +204,12 @@ class InvalidAction(Exception):
         self.action = action
 
 
+class DesyncError(Exception):
+
+    """Raised when the board kept by an agent in delta-percept mode differs
+    from the board of the game."""
+
+
 class Board:
 
     """Representation of an Avalam Board.
@@ -38,8 +219,34 @@ class Board:
     is the color of the top-most counter (negative for red, positive for
     yellow).
 
+    The position is mirrored in bitboards (one bit per cell, see Layout)
+    that are kept up to date by play_action and back the queries on the
+    board.  The set of valid actions is maintained the same
+    way: self._targets gives for each cell the mask of the towers it can be
+    moved on and self._movable the mask of the movable towers.  Do not modify
+    self.m directly; build a new Board from the percepts instead.
+
+    The Zobrist key of the position (see get_hash), its keys through the
+    symmetries of the layout (see get_canonical_hash) and the number of towers
+    and of completed towers of each player (see get_tower_count) are also
+    maintained by play_action and undo_action.
+
+    A tower that can neither move nor be gobbled is frozen: since heights
+    only grow and empty cells stay empty, it keeps its owner until the end of
+    the game.  self._frozen is the mask of the frozen towers; it only grows
+    as play_action makes towers higher or empties their neighbours.
+
     """
 
+    # The bitboards live in slots rather than in __dict__ so that the
+    # instance still marshals (XML-RPC) and pickles as its percepts only.
+    __slots__ = ("__dict__", "_layout", "_occupied", "_yellow", "_red",
+                 "_heights", "_targets", "_movable", "_action_count", "_key",
+                 "_symmetric_keys",
+                 "_yellow_towers", "_red_towers", "_yellow_completed",
+                 "_red_completed", "_frozen", "_yellow_frozen",
+                 "_red_frozen")
+
     # standard avalam
     max_height = 5
     initial_board = [ [ 0,  0,  1, -1,  0,  0,  0,  0,  0],
@@ -68,6 +275,109 @@ class Board:
         self.columns = len(self.m[0])
         self.max_height = max_height
         self.m = self.get_percepts(invert)  # make a copy of the percepts
+        self._build()
+
+    def __getstate__(self):
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def _build(self):
+        """Compute the bitboards from self.m."""
+        top = max([self.max_height] + [abs(x) for row in self.m for x in row])
+        self._heights = [0] * (top + 1)
+        self._occupied = self._yellow = self._red = 0
+        for i in range(self.rows):
+            for j in range(self.columns):
+                x = self.m[i][j]
+                if x:
+                    bit = 1 << (i * self.columns + j)
+                    self._occupied |= bit
+                    self._heights[abs(x)] |= bit
+                    if x > 0:
+                        self._yellow |= bit
+                    else:
+                        self._red |= bit
+        self._layout = _get_layout(self.rows, self.columns, top,
+                                   self._occupied)
+        zobrist = self._layout.zobrist
+        self._key = 0
+        moves = 0
+        for c in _bits(self._occupied):
+            i, j = self._layout.coords[c]
+            x = self.m[i][j]
+            self._key ^= zobrist[c][x + top]
+            moves += abs(x) - 1
+        # every action merges two towers: from a board of single counters,
+        # the number of actions played gives the side to move
+        if moves % 2:
+            self._key ^= ZOBRIST_SIDE
+        self._symmetric_keys = []
+        for table in self._layout.symmetric_zobrist:
+            key = self._key
+            for c in _bits(self._occupied):
+                i, j = self._layout.coords[c]
+                key ^= zobrist[c][self.m[i][j] + top] ^ \
+                    table[c][self.m[i][j] + top]
+            self._symmetric_keys.append(key)
+        full = self._heights[self.max_height]
+        self._yellow_towers = _popcount(self._yellow)
+        self._red_towers = _popcount(self._red)
+        self._yellow_completed = _popcount(self._yellow & full)
+        self._red_completed = _popcount(self._red & full)
+        self._targets = [0] * (self.rows * self.columns)
+        self._movable = self._action_count = 0
+        self._update_targets(self._occupied)
+        # targets are symmetric: a tower without targets is not a target
+        self._frozen = self._occupied & ~self._movable
+        self._yellow_frozen = _popcount(self._yellow & self._frozen)
+        self._red_frozen = _popcount(self._red & self._frozen)
+
+    def _fitting(self):
+        """Return the list of masks of towers of height at most k, for all k
+        in 0..max_height."""
+        fitting = [0]
+        for h in range(1, self.max_height + 1):
+            fitting.append(fitting[-1] | self._heights[h])
+        return fitting
+
+    def _update_targets(self, cells):
+        """Recompute the valid actions of the towers in mask cells.
+
+        Return the list of pairs (cell, previous targets) of the cells whose
+        targets have changed.  The towers losing their last target are added
+        to the frozen ones.
+
+        """
+        fitting = self._fitting()
+        coords = self._layout.coords
+        neighbour_masks = self._layout.neighbour_masks
+        changed = []
+        for c in _bits(cells):
+            i, j = coords[c]
+            h = abs(self.m[i][j])
+            if 0 < h < self.max_height:
+                targets = neighbour_masks[c] & fitting[self.max_height - h]
+            else:
+                targets = 0
+            old = self._targets[c]
+            if targets != old:
+                changed.append((c, old))
+                self._targets[c] = targets
+                self._action_count += _popcount(targets) - _popcount(old)
+                if targets:
+                    self._movable |= 1 << c
+                else:
+                    self._movable &= ~(1 << c)
+                    if h:
+                        self._frozen |= 1 << c
+                        if self.m[i][j] > 0:
+                            self._yellow_frozen += 1
+                        else:
+                            self._red_frozen += 1
+        return changed
 
     def __str__(self):
         def str_cell(i, j):
@@ -81,7 +391,34 @@ class Board:
 
     def clone(self):
         """Return a clone of this object."""
-        return Board(self.m)
+        board = Board.__new__(Board)
+        board.m = [row[:] for row in self.m]
+        board.rows = self.rows
+        board.columns = self.columns
+        board.max_height = self.max_height
+        board._layout = self._layout
+        board._occupied = self._occupied
+        board._yellow = self._yellow
+        board._red = self._red
+        board._heights = self._heights[:]
+        board._targets = self._targets[:]
+        board._movable = self._movable
+        board._action_count = self._action_count
+        board._key = self._key
+        board._symmetric_keys = self._symmetric_keys[:]
+        board._yellow_towers = self._yellow_towers
+        board._red_towers = self._red_towers
+        board._yellow_completed = self._yellow_completed
+        board._red_completed = self._red_completed
+        board._frozen = self._frozen
+        board._yellow_frozen = self._yellow_frozen
+        board._red_frozen = self._red_frozen
+        return board
+
+    def snapshot(self):
+        """Return a BoardSnapshot of the current position."""
+        return BoardSnapshot(bytes([x & 0xFF for row in self.m for x in row]),
+                             self.rows, self.columns, self.max_height)
 
     def get_percepts(self, invert=False):
         """Return the percepts corresponding to the current state.
@@ -105,10 +442,15 @@ class Board:
         h -- height of the tower (absolute value) and owner (sign)
 
         """
-        for i in range(self.rows):
-            for j in range(self.columns):
-                if self.m[i][j]:
-                    yield (i, j, self.m[i][j])
+        for c in _bits(self._occupied):
+            i, j = divmod(c, self.columns)
+            yield (i, j, self.m[i][j])
+
+    def get_live_towers(self):
+        """Yield the towers that are not frozen, as get_towers does."""
+        for c in _bits(self._occupied & ~self._frozen):
+            i, j = divmod(c, self.columns)
+            yield (i, j, self.m[i][j])
 
     def is_action_valid(self, action):
         """Return whether action is a valid action."""
@@ -116,65 +458,187 @@ class Board:
             i1, j1, i2, j2 = action
             if i1 < 0 or j1 < 0 or i2 < 0 or j2 < 0 or \
                i1 >= self.rows or j1 >= self.columns or \
-               i2 >= self.rows or j2 >= self.columns or \
-               (i1 == i2 and j1 == j2) or (abs(i1-i2) > 1) or (abs(j1-j2) > 1):
-                return False
-            h1 = abs(self.m[i1][j1])
-            h2 = abs(self.m[i2][j2])
-            if h1 <= 0 or h1 >= self.max_height or h2 <= 0 or \
-                    h2 >= self.max_height or h1+h2 > self.max_height:
+               i2 >= self.rows or j2 >= self.columns:
                 return False
-            return True
+            c1 = i1 * self.columns + j1
+            c2 = i2 * self.columns + j2
+            return self._targets[c1] >> c2 & 1 == 1
         except (TypeError, ValueError):
             return False
 
     def get_tower_actions(self, i, j):
         """Yield all actions with moving tower (i,j)"""
-        h = abs(self.m[i][j])
-        if h > 0 and h < self.max_height:
-            for di in (-1, 0, 1):
-                for dj in (-1, 0, 1):
-                    action = (i, j, i+di, j+dj)
-                    if self.is_action_valid(action):
-                        yield action
+        c1 = i * self.columns + j
+        moves = self._layout.moves[c1]
+        for c2 in _bits(self._targets[c1]):
+            yield moves[c2]
 
     def is_tower_movable(self, i, j):
         """Return wether tower (i,j) is movable"""
-        for action in self.get_tower_actions(i, j):
-            return True
-        return False
+        return self._targets[i * self.columns + j] != 0
 
     def get_actions(self):
         """Yield all valid actions on this board."""
-        for i, j, h in self.get_towers():
-            for action in self.get_tower_actions(i, j):
-                yield action
+        moves = self._layout.moves
+        for c1 in _bits(self._movable):
+            for c2 in _bits(self._targets[c1]):
+                yield moves[c1][c2]
+
+    def get_layout(self):
+        """Return the Layout shared by this board."""
+        return self._layout
+
+    def get_hash(self):
+        """Return the 64-bit Zobrist key of the position.
+
+        The key covers the signed height of every cell and the side to move
+        (the parity of the number of actions played).  It is maintained
+        incrementally and is the same in every process, so that it can be
+        used to index transposition tables, caches or opening books.
+
+        """
+        return self._key
+
+    def get_canonical_hash(self):
+        """Return a key identifying the position up to the symmetries of the
+        layout.
+
+        Return a pair (key, s): key is the smallest Zobrist key of the images
+        of the position by the symmetries of the layout and s the index of
+        the symmetry giving it.  Positions that are symmetric to each other
+        have the same key and, since the rules do not depend on the
+        orientation of the board, the same value.  An action a found on the
+        canonical position corresponds to the action
+        get_layout().transform_action(get_layout().inverses[s], a) on this
+        one.
+
+        """
+        key, s = self._key, 0
+        for t, k in enumerate(self._symmetric_keys, 1):
+            if k < key:
+                key, s = k, t
+        return (key, s)
+
+    def get_action_count(self):
+        """Return the number of valid actions on this board."""
+        return self._action_count
+
+    def get_movable_count(self):
+        """Return the number of towers that can be moved."""
+        return _popcount(self._movable)
 
     def play_action(self, action):
         """Play an action if it is valid.
 
         An action is a 4-uple containing the row and column of the tower to
         move and the row and column of the tower to gobble. If the action is
-        invalid, raise an InvalidAction exception. Return self.
+        invalid, raise an InvalidAction exception. Return an undo record that
+        can be given to undo_action to restore the board as it was before.
 
         """
         if not self.is_action_valid(action):
             raise InvalidAction(action)
         i1, j1, i2, j2 = action
-        h1 = abs(self.m[i1][j1])
-        h2 = abs(self.m[i2][j2])
-        if self.m[i1][j1] < 0:
-            self.m[i2][j2] = -(h1 + h2)
+        x1 = self.m[i1][j1]
+        x2 = self.m[i2][j2]
+        h1 = abs(x1)
+        h2 = abs(x2)
+        if x1 < 0:
+            x = -(h1 + h2)
         else:
-            self.m[i2][j2] = h1 + h2
+            x = h1 + h2
+        self.m[i2][j2] = x
         self.m[i1][j1] = 0
-        return self
+        c1 = i1 * self.columns + j1
+        c2 = i2 * self.columns + j2
+        b1 = 1 << c1
+        b2 = 1 << c2
+        self._occupied ^= b1
+        self._heights[h1] ^= b1
+        self._heights[h2] ^= b2
+        self._heights[h1 + h2] |= b2
+        key = self._key
+        z = self._layout.zobrist
+        top = self._layout.top
+        self._key ^= z[c1][x1 + top] ^ z[c2][x2 + top] ^ z[c2][x + top] ^ \
+            ZOBRIST_SIDE
+        symmetric_keys = self._symmetric_keys
+        if symmetric_keys:
+            self._symmetric_keys = [
+                k ^ t[c1][x1 + top] ^ t[c2][x2 + top] ^ t[c2][x + top] ^
+                ZOBRIST_SIDE
+                for k, t in zip(symmetric_keys,
+                                self._layout.symmetric_zobrist)]
+        if x1 > 0:
+            self._yellow = (self._yellow ^ b1) | b2
+            self._red &= ~b2
+            if h1 + h2 == self.max_height:
+                self._yellow_completed += 1
+        else:
+            self._red = (self._red ^ b1) | b2
+            self._yellow &= ~b2
+            if h1 + h2 == self.max_height:
+                self._red_completed += 1
+        # the gobbled tower is the only one to disappear
+        if x2 > 0:
+            self._yellow_towers -= 1
+        else:
+            self._red_towers -= 1
+        movable = self._movable
+        action_count = self._action_count
+        frozen = (self._frozen, self._yellow_frozen, self._red_frozen)
+        # only the actions around the two touched towers may have changed
+        neighbour_masks = self._layout.neighbour_masks
+        changed = self._update_targets(neighbour_masks[c1] |
+                                       neighbour_masks[c2] | b1 | b2)
+        return (action, x1, x2, movable, action_count, changed,
+                (key, symmetric_keys), frozen)
+
+    def undo_action(self, record):
+        """Undo an action.
+
+        record is the value returned by the play_action call to undo.  The
+        actions played since then must have been undone first.
+
+        """
+        (i1, j1, i2, j2), x1, x2, movable, action_count, changed, key, \
+            frozen = record
+        self.m[i1][j1] = x1
+        self.m[i2][j2] = x2
+        h1 = abs(x1)
+        h2 = abs(x2)
+        b1 = 1 << (i1 * self.columns + j1)
+        b2 = 1 << (i2 * self.columns + j2)
+        self._occupied |= b1
+        self._heights[h1 + h2] ^= b2
+        self._heights[h1] |= b1
+        self._heights[h2] |= b2
+        if x1 > 0:
+            self._yellow |= b1
+            if h1 + h2 == self.max_height:
+                self._yellow_completed -= 1
+        else:
+            self._red |= b1
+            if h1 + h2 == self.max_height:
+                self._red_completed -= 1
+        if x2 > 0:
+            self._yellow |= b2
+            self._red &= ~b2
+            self._yellow_towers += 1
+        else:
+            self._red |= b2
+            self._yellow &= ~b2
+            self._red_towers += 1
+        for c, targets in changed:
+            self._targets[c] = targets
+        self._movable = movable
+        self._action_count = action_count
+        self._key, self._symmetric_keys = key
+        self._frozen, self._yellow_frozen, self._red_frozen = frozen
 
     def is_finished(self):
         """Return whether no more moves can be made (i.e., game finished)."""
-        for action in self.get_actions():
-            return False
-        return True
+        return self._movable == 0
 
     def get_score(self):
         """Return a score for this board.
@@ -185,31 +649,126 @@ class Board:
         this score represents the winner (<0: red, >0: yellow, 0: draw).
 
         """
-        score = 0
-        for i in range(self.rows):
-            for j in range(self.columns):
-                if self.m[i][j] < 0:
-                    score -= 1
-                elif self.m[i][j] > 0:
-                    score += 1
+        score = self._yellow_towers - self._red_towers
         if score == 0:
-            for i in range(self.rows):
-                for j in range(self.columns):
-                    if self.m[i][j] == -self.max_height:
-                        score -= 1
-                    elif self.m[i][j] == self.max_height:
-                        score += 1
+            score = self._yellow_completed - self._red_completed
         return score
 
+    def get_tower_count(self, player):
+        """Return the number of towers of player (PLAYER1 or PLAYER2)."""
+        if player > 0:
+            return self._yellow_towers
+        return self._red_towers
+
+    def get_completed_count(self, player):
+        """Return the number of towers of player (PLAYER1 or PLAYER2) that
+        have reached the maximal height."""
+        if player > 0:
+            return self._yellow_completed
+        return self._red_completed
+
+    def get_frozen(self):
+        """Return the mask of the frozen towers (see Layout for the bit of
+        each cell)."""
+        return self._frozen
+
+    def get_frozen_count(self, player):
+        """Return the number of frozen towers of player (PLAYER1 or
+        PLAYER2)."""
+        if player > 0:
+            return self._yellow_frozen
+        return self._red_frozen
+
+    def get_decided_score(self):
+        """Return the part of the tower difference that can no longer change.
+
+        It is the difference between the number of frozen towers of each
+        player; the other towers may still change owner or disappear.
+        Completed towers are always frozen.
+
+        """
+        return self._yellow_frozen - self._red_frozen
+
+
+class BoardSnapshot:
+
+    """Compact immutable copy of a board position.
+
+    The signed heights are stored row by row in a bytes object, one signed
+    byte per cell.  Snapshots are hashable and compare equal when they
+    describe the same position, so that they can be kept by the million in
+    traces, replays and caches.  Use Board.snapshot and to_board to convert
+    from and to a Board.
+
+    """
+
+    __slots__ = ("data", "rows", "columns", "max_height")
+
+    def __init__(self, data, rows, columns, max_height=Board.max_height):
+        """Initialize the snapshot.
+
+        Arguments:
+        data -- bytes giving the height of each cell, row by row, as signed
+            bytes
+        rows, columns -- shape of the board
+        max_height -- maximum height of a tower
+
+        """
+        if len(data) != rows * columns:
+            raise ValueError("expected %d cells, got %d" %
+                             (rows * columns, len(data)))
+        object.__setattr__(self, "data", bytes(data))
+        object.__setattr__(self, "rows", rows)
+        object.__setattr__(self, "columns", columns)
+        object.__setattr__(self, "max_height", max_height)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BoardSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("BoardSnapshot is immutable")
+
+    def __reduce__(self):
+        return (BoardSnapshot,
+                (self.data, self.rows, self.columns, self.max_height))
+
+    def __eq__(self, other):
+        if not isinstance(other, BoardSnapshot):
+            return NotImplemented
+        return self.data == other.data and self.rows == other.rows and \
+            self.max_height == other.max_height
+
+    def __hash__(self):
+        return hash((self.data, self.rows, self.max_height))
+
+    def __repr__(self):
+        return "BoardSnapshot(%r, %d, %d, %d)" % \
+            (self.data, self.rows, self.columns, self.max_height)
+
+    def get(self, i, j):
+        """Return the signed height of cell (i, j)."""
+        x = self.data[i * self.columns + j]
+        return x - 256 if x > 127 else x
+
+    def get_percepts(self):
+        """Return the percepts of the position, as Board.get_percepts."""
+        cells = memoryview(self.data).cast("b").tolist()
+        return [cells[k:k + self.columns]
+                for k in range(0, len(cells), self.columns)]
+
+    def to_board(self):
+        """Return a new Board set to this position."""
+        return Board(self.get_percepts(), self.max_height)
+
+
+# build the layout of the standard board first, so that all the standard
+# boards share it (and its symmetries) whatever position they are built from
+Board()
+
 
 def dict_to_board(dictio):
     """Return a clone of the board object encoded as a dictionary."""
-    clone_board = Board()
-    clone_board.m = dictio['m']
-    clone_board.rows = dictio['rows']
-    clone_board.max_height = dictio['max_height']
-
-    return clone_board
+    return Board(dictio['m'], dictio['max_height'])
 
 def load_percepts(filename):
     """Load percepts from a CSV file."""
@@ -246,8 +805,20 @@ class Agent:
         time_left -- a float giving the number of seconds left from the time
             credit for this agent (all players taken together). If the game is
             not time-limited, time_left is None.
+
+        The default implementation keeps a board for each of players in
+        self.delta_boards, for play_delta, leaving the boards of the other
+        players alone: the game initializes each player in turn, both
+        possibly played by the same agent.  percepts may also be a Board
+        there, as when the game calls a local agent.
         """
-        pass
+        if getattr(self, "delta_boards", None) is None:
+            self.delta_boards = {}
+        for player in players:
+            if isinstance(percepts, Board):
+                self.delta_boards[player] = percepts.clone()
+            else:
+                self.delta_boards[player] = dict_to_board(percepts)
 
     def play(self, percepts, player, step, time_left):
         """Play and return an action.
@@ -261,13 +832,59 @@ class Agent:
         """
         pass
 
+    def play_delta(self, action, key, player, step, time_left):
+        """Play and return an action in delta-percept mode, where the agent
+        keeps the board of player received by initialize up to date itself.
+        Since the boards are kept by player, an agent only plays one game
+        at a time in this mode.
+        Arguments:
+        action -- the last action of the opponent, or None if there is none
+        key -- the Zobrist key of the current board (see Board.get_hash), as
+            a hexadecimal string
+        player, step, time_left -- as for play
 
-def serve_agent(agent, address, port):
-    """Serve agent on specified bind address and port number."""
-    from xmlrpc.server import SimpleXMLRPCServer
-    server = SimpleXMLRPCServer((address, port), allow_none=True)
+        The default implementation updates its board with apply_delta, then
+        calls play with the board and plays the action returned.
+        """
+        board = self.apply_delta(action, key, player)
+        result = self.play({'m': board.get_percepts(),
+                            'max_height': board.max_height},
+                           player, step, time_left)
+        board.play_action(tuple(result))
+        return result
+
+    def apply_delta(self, action, key, player):
+        """Play action (None for no action) on the board kept for player
+        and return that board, raising DesyncError if its key then differs
+        from key."""
+        board = self.delta_boards[player]
+        if action is not None:
+            board.play_action(tuple(action))
+        if board.get_hash() != int(key, 16):
+            raise DesyncError("board key %x instead of %s" %
+                              (board.get_hash(), key))
+        return board
+
+
+def serve_agent(agent, address, port, unix=None):
+    """Serve agent on specified bind address and port number, or on the Unix
+    socket at path unix if given.
+
+    The server answers both XML-RPC and the binary protocol of module
+    protocol.  Each connection is handled in its own thread, but the calls
+    to agent are made one at a time.  The server can thus take part in
+    several games at once, except in delta-percept mode, where the agent
+    keeps one board per player (see Agent.play_delta).
+    """
+    if unix is not None:
+        from protocol import UnixAgentServer
+        server = UnixAgentServer(unix)
+        print("Listening on", unix)
+    else:
+        from protocol import AgentServer
+        server = AgentServer((address, port))
+        print("Listening on ", address, ":", port, sep="")
     server.register_instance(agent)
-    print("Listening on ", address, ":", port, sep="")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
@@ -300,10 +917,13 @@ def agent_main(agent, args_cb=None, setup_cb=None):
                         help="bind to address ADDRESS (default: *)")
     parser.add_argument("-p", "--port", type=portarg, default=8000,
                         help="set port number (default: %(default)s)")
+    parser.add_argument("-u", "--unix", metavar="PATH",
+                        help="listen on the Unix socket PATH instead, for" +
+                             " the binary protocol only")
     if args_cb is not None:
         args_cb(agent, parser)
     args = parser.parse_args()
     if setup_cb is not None:
         setup_cb(agent, parser, args)
 
-    serve_agent(agent, args.address, args.port)
\ No newline at end of file
+    serve_agent(agent, args.address, args.port, args.unix)
\ No newline at end of file
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Batched Avalam positions backed by NumPy.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import numpy as np
+
+from avalam import Board, BoardSnapshot, DIRECTIONS, InvalidAction
+
+
+class BoardBatch:
+
+    """A batch of N positions of the same shape.
+
+    self.m is a (N, rows, columns) int8 array holding the signed heights of
+    each position, with the same conventions as Board.m.  All the queries
+    are computed for the whole batch at once and agree with the ones of
+    Board on each position.
+
+    Actions are identified by the codes of Layout.encode_action: the action
+    moving cell c = i*columns + j in direction DIRECTIONS[d] has code
+    8*c + d.  legal_actions returns a (N, rows*columns*8) mask indexed by
+    these codes.
+
+    """
+
+    def __init__(self, positions, max_height=Board.max_height):
+        """Initialize the batch.
+
+        Arguments:
+        positions -- (N, rows, columns) array of signed heights, or sequence
+            of Board, BoardSnapshot or percepts
+        max_height -- maximum height of a tower
+
+        """
+        if not isinstance(positions, np.ndarray):
+            positions = [_percepts(p) for p in positions]
+        self.m = np.array(positions, dtype=np.int8)
+        if self.m.ndim != 3:
+            raise ValueError("expected a (N, rows, columns) array")
+        self.max_height = max_height
+
+    @property
+    def rows(self):
+        return self.m.shape[1]
+
+    @property
+    def columns(self):
+        return self.m.shape[2]
+
+    def __len__(self):
+        return self.m.shape[0]
+
+    def get_board(self, k):
+        """Return a Board set to the k-th position."""
+        return Board(self.m[k].tolist(), self.max_height)
+
+    def get_boards(self):
+        """Return the list of the positions as Boards."""
+        return [Board(m, self.max_height) for m in self.m.tolist()]
+
+    def _neighbour_heights(self, heights):
+        """Return a (N, rows, columns, 8) array giving the height of the
+        neighbour of each cell in each direction (0 off the board)."""
+        padded = np.pad(heights, ((0, 0), (1, 1), (1, 1)))
+        rows, columns = self.rows, self.columns
+        return np.stack([padded[:, 1 + di:1 + di + rows, 1 + dj:1 + dj + columns]
+                         for di, dj in DIRECTIONS], axis=-1)
+
+    def _legal(self):
+        """Return the (N, rows, columns, 8) mask of the valid actions."""
+        heights = np.abs(self.m.astype(np.int16))
+        neighbours = self._neighbour_heights(heights)
+        h = heights[..., np.newaxis]
+        return (h > 0) & (neighbours > 0) & (h + neighbours <= self.max_height)
+
+    def legal_actions(self):
+        """Return the (N, rows*columns*8) mask of the valid action codes."""
+        return self._legal().reshape(len(self), -1)
+
+    def action_counts(self):
+        """Return the number of valid actions of each position."""
+        return self._legal().sum(axis=(1, 2, 3))
+
+    def movable_counts(self):
+        """Return the number of towers that can be moved in each position."""
+        return self._legal().any(axis=3).sum(axis=(1, 2))
+
+    def is_finished(self):
+        """Return the mask of the positions where no more moves can be
+        made."""
+        return ~self._legal().any(axis=(1, 2, 3))
+
+    def tower_counts(self, player):
+        """Return the number of towers of player (PLAYER1 or PLAYER2) in each
+        position."""
+        if player > 0:
+            return (self.m > 0).sum(axis=(1, 2))
+        return (self.m < 0).sum(axis=(1, 2))
+
+    def completed_counts(self, player):
+        """Return the number of towers of player (PLAYER1 or PLAYER2) that
+        have reached the maximal height in each position."""
+        if player > 0:
+            return (self.m == self.max_height).sum(axis=(1, 2))
+        return (self.m == -self.max_height).sum(axis=(1, 2))
+
+    def get_scores(self):
+        """Return the score of each position, as Board.get_score."""
+        towers = (self.m > 0).sum(axis=(1, 2)) - (self.m < 0).sum(axis=(1, 2))
+        completed = (self.m == self.max_height).sum(axis=(1, 2)) - \
+            (self.m == -self.max_height).sum(axis=(1, 2))
+        return np.where(towers != 0, towers, completed)
+
+    def play_actions(self, codes):
+        """Play one action on each position.
+
+        codes is a sequence of N action codes (see Layout.encode_action).
+        If any of them is invalid on its position, raise an InvalidAction
+        exception carrying the decoded action, and leave the batch
+        unchanged.
+
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if codes.shape != (len(self),):
+            raise ValueError("expected %d action codes" % len(self))
+        cells, d = np.divmod(codes, 8)
+        i1, j1 = np.divmod(cells, self.columns)
+        offsets = np.array(DIRECTIONS)
+        i2 = i1 + offsets[d, 0]
+        j2 = j1 + offsets[d, 1]
+        index = np.arange(len(self))
+        legal = self.legal_actions()
+        valid = (codes >= 0) & (codes < legal.shape[1])
+        valid[valid] = legal[index[valid], codes[valid]]
+        if not valid.all():
+            k = int(np.argmin(valid))
+            raise InvalidAction((int(i1[k]), int(j1[k]),
+                                 int(i2[k]), int(j2[k])))
+        x1 = self.m[index, i1, j1].astype(np.int16)
+        x2 = self.m[index, i2, j2].astype(np.int16)
+        h = np.abs(x1) + np.abs(x2)
+        self.m[index, i2, j2] = np.where(x1 < 0, -h, h)
+        self.m[index, i1, j1] = 0
+
+
+def _percepts(position):
+    """Return the signed heights of a Board, BoardSnapshot or percepts."""
+    if isinstance(position, Board):
+        return position.m
+    if isinstance(position, BoardSnapshot):
+        return position.get_percepts()
+    return position
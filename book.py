@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Opening book for the Avalam agents.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import mmap
+import struct
+
+from avalam import *
+
+MAGIC = b"AVBOOK1\0"
+
+# canonical key, value, action code (canonical frame), depth
+RECORD = struct.Struct("<QfHH")
+
+
+class OpeningBook:
+
+    """Read-only opening book.
+
+    The book file holds a header followed by records sorted by the
+    canonical key of the positions (see Board.get_canonical_hash), each
+    giving the best action found for the player to move, the value of the
+    position and the depth of the search.  The positions are seen from the
+    player to move, who plays yellow (as the agents build their boards).
+
+    The file is memory-mapped: a lookup is a binary search that only reads
+    the pages it needs.
+
+    """
+
+    def __init__(self, filename):
+        """Open the book written in filename."""
+        self.file = open(filename, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.file.close()
+            raise ValueError("%s is not an opening book" % filename)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("%s is not an opening book" % filename)
+        self.count = (len(self.map) - len(MAGIC)) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Close the book file."""
+        self.map.close()
+        self.file.close()
+
+    def probe(self, key):
+        """Return the record of canonical key key as a tuple
+        (value, action code, depth), or None if it is not in the book."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = len(MAGIC) + mid * RECORD.size
+            k, value, code, depth = RECORD.unpack_from(self.map, offset)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return (value, code, depth)
+        return None
+
+    def lookup(self, board):
+        """Return the book action for yellow on board, or None."""
+        key, s = board.get_canonical_hash()
+        record = self.probe(key)
+        if record is None:
+            return None
+        layout = board.get_layout()
+        action = layout.transform_action(layout.inverses[s],
+                                         layout.decode_action(record[1]))
+        return action if board.is_action_valid(action) else None
+
+
+def write_book(filename, entries):
+    """Write an opening book.
+
+    entries is a dictionary mapping canonical keys to tuples
+    (value, action code, depth).
+    """
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        for key in sorted(entries):
+            value, code, depth = entries[key]
+            f.write(RECORD.pack(key, value, code, depth))
+
+
+def build_book(agent, plies, depth, board=None):
+    """Search the opening positions and return the book entries (see
+    write_book).
+
+    The positions are the ones met by a player following the book, up to
+    plies actions from board (the initial board by default): each position
+    of that player is searched at depth depth with agent (a MyAgent), its
+    best action is played and all the replies of the opponent are
+    followed.  Both players are covered.
+    """
+    if board is None:
+        board = Board()
+    entries = {}
+    agent.start_move(1)
+
+    def visit(board, ply, player):
+        if ply > plies or board.is_finished():
+            return
+        mover = PLAYER1 if ply % 2 == 0 else PLAYER2
+        if mover != player:
+            for action in list(board.get_actions()):
+                undo = board.play_action(action)
+                visit(board, ply + 1, player)
+                board.undo_action(undo)
+            return
+        view = Board(board.m, board.max_height, invert=(player == PLAYER2))
+        key, s = view.get_canonical_hash()
+        if key in entries:
+            code = entries[key][1]
+            layout = view.get_layout()
+            action = layout.transform_action(layout.inverses[s],
+                                             layout.decode_action(code))
+        else:
+            value, action, reached = agent.h_alphabeta_search(view, depth)
+            layout = view.get_layout()
+            code = layout.encode_action(layout.transform_action(s, action))
+            entries[key] = (value, code, depth)
+            print("ply", ply, "positions", len(entries), "action", action,
+                  "value", value)
+        undo = board.play_action(action)
+        visit(board, ply + 1, player)
+        board.undo_action(undo)
+
+    visit(board, 0, PLAYER1)
+    visit(board, 0, PLAYER2)
+    return entries
+
+
+if __name__ == "__main__":
+    import argparse
+    from my_player import MyAgent
+
+    parser = argparse.ArgumentParser(
+        description="Build an opening book for MyAgent.")
+    parser.add_argument("output", help="book file to write", metavar="FILE")
+    parser.add_argument("--plies", type=int, default=2,
+                        help="number of plies covered by the book" +
+                             " (default: %(default)s)")
+    parser.add_argument("--depth", type=int, default=4,
+                        help="depth of the search of each position" +
+                             " (default: %(default)s)")
+    parser.add_argument("--hash", type=float, default=MyAgent.table_size,
+                        help="size of the transposition table in MB" +
+                             " (default: %(default)s)",
+                        metavar="MB")
+    args = parser.parse_args()
+
+    agent = MyAgent()
+    agent.table_size = args.hash
+    entries = build_book(agent, args.plies, args.depth)
+    write_book(args.output, entries)
+    print("Wrote", len(entries), "positions to", args.output)
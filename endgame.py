@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Exact endgame solver for Avalam.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import math
+import time
+
+from avalam import PLAYER1, PLAYER2
+
+
+class SolverTimeout(Exception):
+
+    """Raised when the deadline of the solver is reached."""
+
+
+class EndgameSolver:
+
+    """Exact solver of the end of a game.
+
+    The solver searches the game to its end with alpha-beta pruning and
+    returns the exact final score (see Board.get_score), yellow to move.
+
+    The results are memoised by the live towers of the board (see
+    Board.get_live_towers) rather than by the whole position: the frozen
+    towers only matter through the number of towers and of completed
+    towers they give each player.  Positions that only differ by their
+    frozen part therefore share their entries.
+
+    Attributes:
+    max_entries -- number of memoised positions at which the memo is
+        cleared, checked before each new entry
+    check_interval -- number of nodes searched between two checks of the
+        deadline
+    nodes -- number of nodes searched by the last call to solve
+
+    """
+
+    max_entries = 1000000
+    check_interval = 1024
+
+    def __init__(self):
+        self.memo = {}
+        self.nodes = 0
+
+    def get_key(self, board, maximize):
+        """Return the memo key of board, with yellow to move if maximize."""
+        layout = board.get_layout()
+        zobrist = layout.zobrist
+        top = layout.top
+        columns = board.columns
+        live = 0
+        for i, j, x in board.get_live_towers():
+            live ^= zobrist[i * columns + j][x + top]
+        return (live,
+                board.get_decided_score(),
+                board.get_completed_count(PLAYER1) -
+                board.get_completed_count(PLAYER2),
+                maximize)
+
+    def solve(self, board, deadline=None):
+        """Return a pair (score, action): the exact final score of board
+        with yellow to move and perfect play, and the action of yellow
+        reaching it.
+
+        The board is left unchanged on return.  If deadline (a
+        time.perf_counter() value) is reached, raise SolverTimeout.
+        """
+        self.nodes = 0
+        memo = self.memo
+
+        def search(board, alpha, beta, maximize):
+            self.nodes += 1
+            if deadline is not None and \
+                    self.nodes % self.check_interval == 0 and \
+                    time.perf_counter() >= deadline:
+                raise SolverTimeout
+            if board.is_finished():
+                return (board.get_score(), None)
+            key = self.get_key(board, maximize)
+            lower, upper, first = memo.get(key, (-math.inf, math.inf, None))
+            if lower >= beta or lower == upper:
+                return (lower, first)
+            if upper <= alpha:
+                return (upper, first)
+            alpha_start = alpha = max(alpha, lower)
+            beta_start = beta = min(beta, upper)
+            actions = board.get_actions()
+            if first is not None:
+                actions = [first] + [a for a in actions if a != first]
+            best_value = -math.inf if maximize else math.inf
+            best_action = None
+            for action in actions:
+                undo = board.play_action(action)
+                try:
+                    value = search(board, alpha, beta, not maximize)[0]
+                finally:
+                    board.undo_action(undo)
+                if maximize and value > best_value or \
+                        not maximize and value < best_value:
+                    best_value = value
+                    best_action = action
+                    if maximize:
+                        alpha = max(alpha, value)
+                    else:
+                        beta = min(beta, value)
+                    if alpha >= beta:
+                        break
+            if len(memo) >= self.max_entries and key not in memo:
+                memo.clear()
+            if best_value <= alpha_start:
+                memo[key] = (lower, best_value, best_action)
+            elif best_value >= beta_start:
+                memo[key] = (best_value, upper, best_action)
+            else:
+                memo[key] = (best_value, best_value, best_action)
+            return (best_value, best_action)
+
+        return search(board, -math.inf, math.inf, True)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluation cache for the Avalam agents.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+from collections import OrderedDict
+
+
+class EvaluationCache:
+
+    """Memoise a board evaluation function.
+
+    An EvaluationCache is called like the function it wraps, with a Board,
+    and returns the same value.  The values are kept by Zobrist key (see
+    Board.get_hash) in a cache of fixed capacity that evicts the least
+    recently used value when it is full.  This pays off for heuristics
+    that cost more than a lookup, as soon as positions are met again
+    through transpositions or between the passes of iterative deepening.
+
+    Attributes:
+    function -- the evaluation function, taking a Board
+    capacity -- maximum number of values kept
+    hits, misses -- number of calls answered from the cache or not
+
+    """
+
+    def __init__(self, function, capacity=2 ** 20):
+        if capacity < 1:
+            raise ValueError("the capacity must be positive")
+        self.function = function
+        self.capacity = capacity
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, board):
+        key = board.get_hash()
+        values = self.values
+        value = values.get(key)
+        if value is not None:
+            self.hits += 1
+            values.move_to_end(key)
+            return value
+        self.misses += 1
+        value = self.function(board)
+        values[key] = value
+        if len(values) > self.capacity:
+            values.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self.values)
+
+    def clear(self):
+        """Remove all the values and reset the counters."""
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_hit_rate(self):
+        """Return the fraction of the calls answered from the cache."""
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def __str__(self):
+        return "%d/%d values, %d hits, %d misses, %.1f%% hits" % \
+            (len(self.values), self.capacity, self.hits, self.misses,
+             100 * self.get_hit_rate())
@@ -26,15 +26,21 @@ import socket
 import xmlrpc.client
 import pickle
 import importlib
+import multiprocessing
 import subprocess
 
 from avalam import *
+from protocol import BinaryAgentProxy
 
 
 class TimeCreditExpired(Exception):
     """An agent has expired its time credit."""
 
 
+class DeltaUnsupported(Exception):
+    """An agent does not support the methods of delta-percept mode."""
+
+
 class Viewer(Agent):
 
     """Interface for an Avalam viewer and human agent."""
@@ -137,7 +143,7 @@ class Trace:
     Attributes:
     time_limits -- a sequence of 2 elements containing the time limits in
         seconds for each agent, or None for a time-unlimitted agent
-    initial_board -- the initial board
+    initial_board -- a snapshot of the initial board
     actions -- list of tuples (player, action, time) of the played action.
         Respectively, the player number, the action and the time taken in
         seconds.
@@ -156,7 +162,7 @@ class Trace:
 
         """
         self.time_limits = [t for t in time_limits]
-        self.initial_board = board.clone()
+        self.initial_board = board.snapshot()
         self.actions = []
         self.winner = 0
         self.reason = ""
@@ -187,7 +193,10 @@ class Trace:
 
     def get_initial_board(self):
         """Return a Board instance representing the initial board."""
-        return self.initial_board.clone()
+        if isinstance(self.initial_board, Board):
+            # trace written before snapshots were introduced
+            return self.initial_board.clone()
+        return self.initial_board.to_board()
 
     def write(self, f):
         """Write the trace to a file."""
@@ -203,7 +212,8 @@ class Game:
 
     """Main Avalam game class."""
 
-    def __init__(self, agents, board, viewer=None, credits=[None, None]):
+    def __init__(self, agents, board, viewer=None, credits=[None, None],
+                 delta=False):
         """New Avalam game.
 
         Arguments:
@@ -213,11 +223,21 @@ class Game:
         viewer -- the viewer or None if none should be used
         credits -- a sequence of 2 elements containing the time credit in
             seconds for each agent, or None for a time-unlimitted agent
+        delta -- if True, play in delta-percept mode: the agents receive the
+            initial board through Agent.initialize, then only the last
+            action of their opponent and the key of the board through
+            Agent.play_delta.  The viewer, when it plays, and the agents
+            answering that these methods are not supported still receive
+            the whole board through Agent.play.  An agent server can play
+            both colours of a game in this mode, but not several games at
+            once.
 
         """
         self.agents = agents
-        self.board = board
         self.viewer = viewer if viewer is not None else Viewer()
+        self.delta = [delta and agent is not self.viewer for agent in agents]
+        self.last_action = None
+        self.board = board
         self.credits = credits
         self.step = 0
         self.player = 1
@@ -232,25 +252,32 @@ class Game:
         """Play the game."""
         logging.info("Starting new game")
         try:
-            """
-            for agent in [1, -1]:
-                logging.debug("Initializing agent %d", agent)
-                self.timed_exec("initialize",
-                    self.board,
-                    [agent, -agent],
-                    agent=agent)
-            """
+            for player in [1, -1]:
+                if self.delta[0 if player > 0 else 1]:
+                    logging.debug("Initializing player %d", player)
+                    self.player = player
+                    self.delta_exec("initialize", self.board, [player])
+            self.player = 1
 
             while not self.board.is_finished():
                 self.step += 1
                 logging.debug("Asking player %d to play step %d",
                               self.player, self.step)
                 self.viewer.playing(self.step, self.player)
-                action, t = self.timed_exec("play",
-                                            self.board,
-                                            self.player,
-                                            self.step)
+                agent = 0 if self.player > 0 else 1
+                if self.delta[agent]:
+                    action, t = self.delta_exec("play_delta",
+                                                self.last_action,
+                                                "%x" % self.board.get_hash(),
+                                                self.player,
+                                                self.step)
+                if not self.delta[agent]:
+                    action, t = self.timed_exec("play",
+                                                self.board,
+                                                self.player,
+                                                self.step)
                 self.board.play_action(action)
+                self.last_action = action
                 self.viewer.update(self.step, action, self.player)
                 self.trace.add_action(self.player, action, t)
                 self.player = -self.player
@@ -279,6 +306,22 @@ class Game:
         self.trace.set_winner(winner, reason)
         self.viewer.finished(self.step, winner, reason)
 
+    def delta_exec(self, fn, *args):
+        """Call timed_exec(fn, *args) for a method of delta-percept mode.
+
+        If the agent of the current player answers that fn is not
+        supported, it plays with Agent.play for the rest of the game
+        instead, and (None, 0.0) is returned.
+        """
+        agent = 0 if self.player > 0 else 1
+        try:
+            return self.timed_exec(fn, *args)
+        except DeltaUnsupported:
+            logging.info("Player %d does not support %s, sending it the" +
+                         " whole board", agent + 1, fn)
+            self.delta[agent] = False
+            return (None, 0.0)
+
     def timed_exec(self, fn, *args, agent=None):
         """Execute self.agents[agent].fn(*args, time_left) with the
         time limit for the current player.
@@ -299,11 +342,16 @@ class Game:
             socket.setdefaulttimeout(self.credits[agent] + 1)
         start = time.time()
         try:
-            result = self.agents[agent].play(*args + (self.credits[agent],))
+            result = getattr(self.agents[agent], fn)(
+                *args + (self.credits[agent],))
         except socket.timeout:
             self.credits[agent] = -1.0  # ensure it is counted as expired
             raise TimeCreditExpired
         except (socket.error, xmlrpc.client.Fault) as e:
+            if fn in ("initialize", "play_delta") and \
+                    isinstance(e, xmlrpc.client.Fault) and \
+                    'method "%s" is not supported' % fn in e.faultString:
+                raise DeltaUnsupported
             logging.error("Player %d was unable to play step %d." +
                           " Reason: %s", agent + 1, self.step, e)
             raise InvalidAction
@@ -325,11 +373,164 @@ class Game:
         return (result, t)
 
 
-def connect_agent(uri):
-    """Connect to a remote player and return a proxy for the Player object."""
+def connect_agent(uri, binary=True):
+    """Connect to a remote player and return a proxy for the Player object.
+
+    If binary is True, the binary protocol (see module protocol) is tried
+    first, falling back to XML-RPC if the agent does not support it.  URIs
+    unix:PATH of Unix sockets require the binary protocol.
+    """
+    if binary or uri.startswith("unix:"):
+        proxy = BinaryAgentProxy.connect(uri)
+        if proxy is not None:
+            return proxy
+        if uri.startswith("unix:"):
+            raise socket.error("no binary agent server at %s" % uri)
+        logging.info("%s does not support the binary protocol, using" +
+                     " XML-RPC", uri)
     return xmlrpc.client.ServerProxy(uri, allow_none=True)
 
 
+def is_agent_spec(string):
+    """Return whether string is an agent spec module:Class rather than the
+    URI of a remote agent."""
+    return "://" not in string and ":" in string and \
+        not string.startswith("unix:")
+
+
+def load_agent(spec):
+    """Import the agent given by spec, of the form module:Class, and return
+    a new instance of it."""
+    module, name = spec.rsplit(":", 1)
+    return getattr(importlib.import_module(module), name)()
+
+
+def board_to_percepts(board):
+    """Return board as a remote agent receives it through XML-RPC: a
+    dictionary with the keys m and max_height."""
+    return {'m': board.get_percepts(), 'max_height': board.max_height}
+
+
+class LocalAgent:
+
+    """Agent loaded and called in the process of the game.
+
+    The board is handed over as the percepts a remote agent would receive,
+    without the XML-RPC round trip.  The agent cannot be interrupted: a move
+    taking too long is only detected once it returns.
+
+    """
+
+    def __init__(self, spec):
+        self.agent = load_agent(spec)
+
+    def initialize(self, board, players, time_left):
+        return self.get_method("initialize")(board_to_percepts(board),
+                                             players, time_left)
+
+    def play(self, board, player, step, time_left):
+        return self.agent.play(board_to_percepts(board), player, step,
+                               time_left)
+
+    def play_delta(self, action, key, player, step, time_left):
+        return self.get_method("play_delta")(action, key, player, step,
+                                             time_left)
+
+    def get_method(self, fn):
+        """Return method fn of the agent, raising xmlrpc.client.Fault as an
+        agent server does if it has none."""
+        method = getattr(self.agent, fn, None)
+        if method is None:
+            raise xmlrpc.client.Fault(1, 'method "%s" is not supported' % fn)
+        return method
+
+
+def _serve_pipe(conn, spec):
+    """Run the agent given by spec, answering the calls received on the
+    connection conn (see ProcessAgent)."""
+    try:
+        agent = load_agent(spec)
+        error = None
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    while True:
+        try:
+            call = conn.recv()
+        except EOFError:
+            break
+        if call is None:
+            break
+        if error is not None:
+            conn.send((False, error))
+            continue
+        fn, args = call
+        if not hasattr(agent, fn):
+            conn.send((False, 'method "%s" is not supported' % fn))
+            continue
+        try:
+            conn.send((True, getattr(agent, fn)(*args)))
+        except Exception as e:
+            conn.send((False, "%s: %s" % (type(e).__name__, e)))
+    conn.close()
+
+
+class ProcessAgent:
+
+    """Agent loaded in a dedicated child process, called over a pipe.
+
+    The calls carry the same percepts as XML-RPC but are pickled, which is
+    much cheaper than the XML marshalling.  As with a remote agent, a call
+    that does not answer within the time credit plus one second raises
+    socket.timeout, and a failed call raises xmlrpc.client.Fault.
+
+    """
+
+    def __init__(self, spec):
+        self.conn, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve_pipe,
+                                               args=(child, spec))
+        self.process.start()
+        child.close()
+
+    def initialize(self, board, players, time_left):
+        return self.call("initialize", (board_to_percepts(board), players,
+                                        time_left), time_left)
+
+    def play(self, board, player, step, time_left):
+        return self.call("play", (board_to_percepts(board), player, step,
+                                  time_left), time_left)
+
+    def play_delta(self, action, key, player, step, time_left):
+        return self.call("play_delta", (action, key, player, step,
+                                        time_left), time_left)
+
+    def call(self, fn, args, time_left):
+        """Call method fn of the agent with args and return its result."""
+        self.conn.send((fn, args))
+        if time_left is not None and not self.conn.poll(time_left + 1):
+            self.close()
+            raise socket.timeout("no answer from the agent process")
+        try:
+            ok, result = self.conn.recv()
+        except EOFError:
+            raise socket.error("the agent process has exited")
+        if not ok:
+            raise xmlrpc.client.Fault(1, result)
+        return result
+
+    def close(self):
+        """Stop the child process."""
+        if self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.conn.close()
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -344,13 +545,29 @@ if __name__ == "__main__":
         usage="%(prog)s [options] AGENT1 AGENT2\n" +
               "       %(prog)s [options] -r FILE")
     parser.add_argument("agent1", nargs='?', default='human',
-                        help="path to the first agent (Player 1) or" +
-                             " keyword 'human' (default: human)",
+                        help="URI of the first agent (Player 1) such as" +
+                             " http://localhost:8000 or unix:PATH, agent" +
+                             " class module:Class to load without a" +
+                             " server, or keyword 'human' (default: human)",
                         metavar="AGENT1")
     parser.add_argument("agent2", nargs='?', default='human',
-                        help="path to the second agent (Player 2) or" +
-                             " keyword 'human' (default: human)",
+                        help="URI of the second agent (Player 2) such as" +
+                             " http://localhost:8000 or unix:PATH, agent" +
+                             " class module:Class to load without a" +
+                             " server, or keyword 'human' (default: human)",
                         metavar="AGENT2")
+    parser.add_argument("--xmlrpc", action="store_true", default=False,
+                        help="talk to the remote agents with XML-RPC only," +
+                             " without trying the binary protocol")
+    parser.add_argument("--delta", action="store_true", default=False,
+                        help="delta-percept mode: send the agents the" +
+                             " initial board once, then only the last" +
+                             " action of their opponent")
+    parser.add_argument("--in-process", action="store_true", default=False,
+                        help="run the module:Class agents in the game" +
+                             " process rather than in child processes" +
+                             " (they cannot be stopped when their time" +
+                             " credit expires)")
     parser.add_argument("-v", "--verbose", action="store_true", default=False,
                         help="be verbose")
     parser.add_argument("--no-gui",
@@ -440,17 +657,27 @@ if __name__ == "__main__":
         for i in range(2):
             if agents[i] == 'human':
                 agents[i] = viewer
+            elif is_agent_spec(agents[i]):
+                if args.in_process:
+                    agents[i] = LocalAgent(agents[i])
+                else:
+                    agents[i] = ProcessAgent(agents[i])
+                credits[i] = args.time
             else:
-                agents[i] = connect_agent(agents[i])
+                agents[i] = connect_agent(agents[i], not args.xmlrpc)
                 credits[i] = args.time
 
-        game = Game(agents, board, viewer, credits)
+        game = Game(agents, board, viewer, credits, args.delta)
 
         def play():
             try:
                 game.startPlaying()
             except KeyboardInterrupt:
                 exit()
+            finally:
+                for agent in agents:
+                    if isinstance(agent, (ProcessAgent, BinaryAgentProxy)):
+                        agent.close()
             if args.write is not None:
                 logging.info("Writing trace to '%s'", args.write.name)
                 try:
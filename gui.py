@@ -117,8 +117,8 @@ class SimpleMessager(WebSocket):
       self.server.step -= 1
       player, action, t = self.server.trace.actions[self.server.step]
       i1, j1, i2, j2 = action
-      formerTowerFrom = self.server.boards[self.server.step].m[i1][j1]
-      formerTowerTo = self.server.boards[self.server.step].m[i2][j2]
+      formerTowerFrom = self.server.boards[self.server.step].get(i1, j1)
+      formerTowerTo = self.server.boards[self.server.step].get(i2, j2)
       self.sendMessage(PREVIOUS_MSG + "\n" + str(player) + "\n" + self.actionToString(action) + "\n" + str(formerTowerFrom) + " " + str(formerTowerTo))
 
   def sendNextStep(self):
@@ -234,16 +234,16 @@ class WebViewer(Viewer):
     """
     self.trace = trace
     self.speed = speed
-    # generate all boards to access them backwards
-    self.boards = [trace.get_initial_board()]
+    # generate snapshots of all boards to access them backwards
+    b = trace.get_initial_board()
+    self.boards = [b.snapshot()]
     for step in range(len(trace.actions)):
       player, action, t = trace.actions[step]
-      b = self.boards[-1].clone()
       b.play_action(action)
-      self.boards.append(b)
+      self.boards.append(b.snapshot())
     self.step = 0
     self.server.initialize_replay(self.trace, self.speed, self.boards)
-    self.init_viewer(self.boards[0], None)
+    self.init_viewer(self.boards[0].to_board(), None)
 
   def close_sig_handler(self, signal, frame):
     self.server.close()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Monte-Carlo Tree Search Avalam agent.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import math
+import random
+import time
+
+from avalam import *
+from my_player import action_priority
+
+
+class Node:
+
+    """Node of the search tree.
+
+    Attributes:
+    action -- action leading to this node from its parent
+    children -- dictionary mapping the actions tried from this node to the
+        resulting nodes
+    untried -- list of the actions not tried yet, or None if the node has
+        not been expanded
+    visits -- number of playouts through this node
+    wins -- sum of the results of these playouts for the player who played
+        action (1 for a win, 0.5 for a draw)
+
+    """
+
+    __slots__ = ("action", "children", "untried", "visits", "wins")
+
+    def __init__(self, action=None):
+        self.action = action
+        self.children = {}
+        self.untried = None
+        self.visits = 0
+        self.wins = 0.0
+
+
+class MCTSAgent(Agent):
+
+    """Avalam agent using Monte-Carlo Tree Search with UCT selection.
+
+    The tree is kept between two moves of a game: the subtree of the
+    position reached after the reply of the opponent becomes the new root.
+
+    Attributes:
+    exploration -- exploration constant of UCT
+    rollout -- playout policy, "random" (as RandomAgent) or "greedy" (as
+        GreedyAgent)
+    probability -- probability that the greedy policy plays its preferred
+        action rather than a random one
+    untimed_playouts -- number of playouts per move when the game is not
+        time-limited
+    margin -- seconds of the time credit kept aside for the communication
+        with the game server
+    min_moves -- lower bound on the estimated number of moves left to play
+
+    """
+
+    exploration = math.sqrt(2)
+    rollout = "random"
+    probability = 0.8
+    untimed_playouts = 2000
+    margin = 0.5
+    min_moves = 2
+
+    def __init__(self):
+        self.root = None
+        self.position = None
+
+    def play(self, percepts, player, step, time_left):
+        # search from the point of view of the yellow player
+        board = Board(percepts['m'], percepts['max_height'],
+                      invert=(player == PLAYER2))
+        root = self.find_root(board)
+        reused = root.visits
+        deadline = None
+        if time_left is not None:
+            moves = max(self.min_moves, board.get_movable_count() // 3)
+            deadline = time.perf_counter() + \
+                max(0.0, time_left - self.margin) / moves
+        start = time.perf_counter()
+        playouts = 0
+        while True:
+            if deadline is None:
+                if playouts >= self.untimed_playouts:
+                    break
+            elif time.perf_counter() >= deadline:
+                break
+            self.run_playout(board, root)
+            playouts += 1
+        elapsed = time.perf_counter() - start
+        print("step", step, "player", player, "playouts", playouts,
+              "(%d reused)" % reused,
+              "playouts/s %.0f" % (playouts / elapsed if elapsed else 0.0))
+        if not root.children:
+            # no time for a single playout
+            action = next(board.get_actions())
+            child = Node(action)
+        else:
+            child = max(root.children.values(), key=lambda c: c.visits)
+            action = child.action
+        board.play_action(action)
+        self.root = child
+        self.position = board.snapshot()
+        return action
+
+    def find_root(self, board):
+        """Return the node of board in the tree kept from the previous move,
+        or a new node if it is not in the tree."""
+        root, position = self.root, self.position
+        self.root = self.position = None
+        if root is not None and root.children:
+            previous = position.to_board()
+            key = board.get_hash()
+            for action, child in root.children.items():
+                undo = previous.play_action(action)
+                found = previous.get_hash() == key and \
+                    previous.m == board.m
+                previous.undo_action(undo)
+                if found:
+                    return child
+        return Node()
+
+    def run_playout(self, board, root):
+        """Run one playout from root, the node of board, and update the
+        statistics of the nodes on its path.
+
+        The board is left unchanged on return.
+        """
+        path = [root]
+        undos = []
+        node = root
+        # selection: descend through fully expanded nodes
+        while node.untried is not None and not node.untried and \
+                node.children:
+            log_visits = math.log(node.visits)
+            node = max(node.children.values(),
+                       key=lambda c: c.wins / c.visits +
+                       self.exploration * math.sqrt(log_visits / c.visits))
+            undos.append(board.play_action(node.action))
+            path.append(node)
+        # expansion
+        if node.untried is None:
+            node.untried = list(board.get_actions())
+            random.shuffle(node.untried)
+        if node.untried:
+            child = Node(node.untried.pop())
+            node.children[child.action] = child
+            undos.append(board.play_action(child.action))
+            path.append(child)
+        # simulation
+        player = PLAYER1 if len(path) % 2 else PLAYER2
+        while not board.is_finished():
+            undos.append(board.play_action(self.rollout_action(board,
+                                                               player)))
+            player = -player
+        score = board.get_score()
+        while undos:
+            board.undo_action(undos.pop())
+        # backpropagation: the actions of odd depths are played by yellow
+        result = 1.0 if score > 0 else 0.0 if score < 0 else 0.5
+        for depth, node in enumerate(path):
+            node.visits += 1
+            node.wins += result if depth % 2 else 1.0 - result
+
+    def rollout_action(self, board, player):
+        """Return the action played by player on board during a playout."""
+        actions = list(board.get_actions())
+        if self.rollout == "greedy" and random.random() < self.probability:
+            return min(actions,
+                       key=lambda a: action_priority(board, a, player))
+        return random.choice(actions)
+
+
+def add_arguments(agent, parser):
+    """Add the options of MCTSAgent to parser (see agent_main)."""
+    parser.add_argument("--rollout", choices=("random", "greedy"),
+                        default=agent.rollout,
+                        help="playout policy (default: %(default)s)")
+    parser.add_argument("--playouts", type=int,
+                        default=agent.untimed_playouts,
+                        help="playouts per move in untimed games" +
+                             " (default: %(default)s)",
+                        metavar="N")
+
+
+def setup(agent, parser, args):
+    """Configure agent from the options of add_arguments."""
+    if args.playouts < 1:
+        parser.error("the number of playouts must be positive")
+    agent.rollout = args.rollout
+    agent.untimed_playouts = args.playouts
+
+
+if __name__ == "__main__":
+    agent_main(MCTSAgent(), add_arguments, setup)
@@ -18,12 +18,264 @@ along with this program; if not, see <http://www.gnu.org/licenses/>.
 
 """
 from avalam import *
+from book import OpeningBook
+from endgame import EndgameSolver, SolverTimeout
+from evalcache import EvaluationCache
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+import itertools
+import json
 import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+
+class SearchTimeout(Exception):
+
+    """Raised when the deadline of a search is reached."""
+
+
+def action_priority(board, action, player):
+    """Return the static rank of action for player, lower is better.
+
+    As in GreedyAgent, the actions are ranked by the tower they build: first
+    the towers of player, the highest first, then the towers of the
+    opponent, the lowest first.  Among them, gobbling a tower of the
+    opponent comes before covering one of our own.
+    """
+    i1, j1, i2, j2 = action
+    x1 = board.m[i1][j1]
+    x2 = board.m[i2][j2]
+    h = abs(x1) + abs(x2)
+    ours = (x2 > 0) == (player > 0)
+    if (x1 > 0) == (player > 0):
+        return (board.max_height - h, ours)
+    return (board.max_height - 3 + h, ours)
+
+
+class MoveOrdering:
+
+    """Order the actions tried by the search.
+
+    The actions of a position are tried in this order: the best action
+    found by a previous search (from the transposition table), the killer
+    actions of the ply (actions that recently caused a cutoff at the same
+    ply), then the other actions by action_priority and history score (how
+    much each action caused cutoffs, weighted by the remaining depth).
+
+    Attributes:
+    killers -- list giving the killer actions of each ply
+    history -- dictionary giving the history score of each action
+    cutoffs -- number of cutoffs since new_search
+    first_cutoffs -- number of these cutoffs caused by the first action
+        tried
+
+    """
+
+    def __init__(self):
+        self.killers = []
+        self.history = {}
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+
+    def new_search(self):
+        """Prepare for the search of a new move."""
+        self.killers = []
+        # the scores of the previous move are a hint, but get older
+        self.history = {a: h // 2 for a, h in self.history.items() if h > 1}
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+
+    def actions(self, board, player, ply, first=None):
+        """Yield the valid actions of board for player in search order.
+
+        first is the best action of the position found by a previous search,
+        or None.  The board may be changed between two actions, provided it
+        is restored when the next one is asked for.
+        """
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        if first is not None:
+            yield first
+        killers = [a for a in self.killers[ply]
+                   if a != first and board.is_action_valid(a)]
+        for action in killers:
+            yield action
+        history = self.history
+        others = [a for a in board.get_actions()
+                  if a != first and a not in killers]
+        others.sort(key=lambda a: (action_priority(board, a, player),
+                                   -history.get(a, 0)))
+        for action in others:
+            yield action
+
+    def add_cutoff(self, action, ply, depth, index):
+        """Record that action, the index-th action tried at ply, caused a
+        cutoff with depth plies left to search."""
+        self.cutoffs += 1
+        if index == 0:
+            self.first_cutoffs += 1
+        killers = self.killers[ply]
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        self.history[action] = self.history.get(action, 0) + depth * depth
+
+    def get_first_cutoff_rate(self):
+        """Return the fraction of the cutoffs caused by the first action."""
+        return self.first_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def __str__(self):
+        return "%d cutoffs, %.1f%% by the first action" % \
+            (self.cutoffs, 100 * self.get_first_cutoff_rate())
+
+
+class SearchStats:
+
+    """Statistics of the search of one move.
+
+    Attributes:
+    step, player -- step and player of the move
+    source -- how the action was found: "book", "endgame", "search" or
+        "parallel"
+    nodes -- number of positions visited
+    leaves -- number of positions evaluated (final or at the cutoff)
+    cutoffs -- number of beta cutoffs
+    first_cutoffs -- number of these cutoffs caused by the first action
+    depths -- list of dictionaries describing each completed depth: the
+        time spent on that depth, the time elapsed since the beginning of
+        the move, the nodes searched for that depth, the value and the best
+        action
+    pv -- principal variation, the actions expected from the position
+
+    """
+
+    def __init__(self, step, player):
+        self.step = step
+        self.player = player
+        self.start = self.depth_start = time.perf_counter()
+        self.source = "search"
+        self.action = None
+        self.nodes = 0
+        self.leaves = 0
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.depths = []
+        self.pv = []
+
+    def add_counts(self, nodes, leaves, cutoffs, first_cutoffs):
+        """Add search counters."""
+        self.nodes += nodes
+        self.leaves += leaves
+        self.cutoffs += cutoffs
+        self.first_cutoffs += first_cutoffs
+
+    def add_depth(self, depth, nodes, value, action):
+        """Record a completed depth."""
+        now = time.perf_counter()
+        self.depths.append({"depth": depth,
+                            "time": now - self.depth_start,
+                            "elapsed": now - self.start,
+                            "nodes": nodes,
+                            "value": value,
+                            "action": action})
+        self.depth_start = now
+
+    def to_dict(self):
+        """Return the statistics as a dictionary."""
+        elapsed = time.perf_counter() - self.start
+        interior = self.nodes - self.leaves
+        branching = None
+        if len(self.depths) >= 2 and self.depths[-2]["nodes"]:
+            branching = self.depths[-1]["nodes"] / self.depths[-2]["nodes"]
+        return {"step": self.step,
+                "player": self.player,
+                "action": self.action,
+                "source": self.source,
+                "time": elapsed,
+                "nodes": self.nodes,
+                "leaves": self.leaves,
+                "nps": self.nodes / elapsed if elapsed else None,
+                "branching": branching,
+                "cutoff_rate": self.cutoffs / interior if interior else None,
+                "first_cutoff_rate": self.first_cutoffs / self.cutoffs
+                                     if self.cutoffs else None,
+                "depths": self.depths,
+                "pv": self.pv}
+
+    def write(self, sink):
+        """Write the statistics as a JSON line to file object sink."""
+        sink.write(json.dumps(self.to_dict()) + "\n")
+        sink.flush()
+
 
 class MyAgent(Agent):
 
-    """My Avalam agent."""
-    
+    """My Avalam agent.
+
+    Attributes:
+    untimed_depth -- depth searched when the game is not time-limited
+    margin -- seconds of the time credit kept aside for the communication
+        with the game server
+    min_moves -- lower bound on the estimated number of moves left to play
+    check_interval -- number of nodes searched between two checks of the
+        deadline
+    table_size -- size of the transposition table in MB
+    table -- the transposition table, kept from one move to the next of
+        the same game
+    ordering -- the MoveOrdering of the search
+    nodes -- number of nodes searched since the beginning of the move
+    workers -- number of processes searching in parallel (see
+        parallel_deepening)
+    ponder -- whether to keep searching while the opponent thinks (see
+        start_pondering); only used with a single worker
+    ponder_replies -- number of replies of the opponent searched when
+        pondering
+    endgame_towers -- number of movable towers from which the game is
+        solved exactly (see EndgameSolver), 0 to never solve it
+    book_file -- file name of the opening book (see book.py), or None
+    heuristic -- evaluation function of the positions at the cutoff
+    stats_file -- file name where the SearchStats of each move are
+        appended as JSON lines, "-" for the standard output (mixed with
+        the other messages of the agent) or None (the default)
+    eval_cache_size -- number of evaluations kept in an EvaluationCache,
+        0 to evaluate every position
+
+    """
+
+    untimed_depth = 3
+    margin = 0.5
+    min_moves = 2
+    check_interval = 256
+    table_size = 16
+    workers = 1
+    ponder = False
+    ponder_replies = 4
+    endgame_towers = 12
+    book_file = None
+    eval_cache_size = 0
+    stats_file = None
+
+    def __init__(self):
+        self.table = None
+        self.last_step = 0
+        self.ordering = MoveOrdering()
+        self.nodes = 0
+        self.pool = None
+        self.alpha = None
+        self.views = {}
+        self.ponder_thread = None
+        self.stop = threading.Event()
+        self.solver = EndgameSolver()
+        self.book = None
+        self.heuristic = lambda board : board.get_score()
+        self.evaluate = None
+        self.leaves = 0
+        self.stats = None
+        self.stats_sink = None
+
     def initialize(self, percepts, players, time_left):
         """Begin a new game.
         The computation done here also counts in the time credit.
@@ -35,7 +287,19 @@ class MyAgent(Agent):
             credit for this agent (all players taken together). If the game is
             not time-limited, time_left is None.
         """
-        pass
+        super().initialize(percepts, players, time_left)
+        # the board of each player seen from yellow, kept for play_delta
+        for player in players:
+            board = self.delta_boards[player]
+            self.views[player] = Board(board.m, board.max_height,
+                                       invert=(player == PLAYER2))
+        self.open_book()
+
+    def open_book(self):
+        """Open self.book_file if it is not open yet."""
+        if self.book is None and self.book_file is not None:
+            self.book = OpeningBook(self.book_file)
+            print("opening book:", len(self.book), "positions")
 
     def play(self, percepts, player, step, time_left):
         """
@@ -57,63 +321,582 @@ class MyAgent(Agent):
         print("step:", step)
         print("time left:", time_left if time_left else '+inf')
 
-        board = dict_to_board(percepts)
-        board.get_percepts((player == -1))
+        # search from the point of view of the yellow (max) player
+        board = Board(percepts['m'], percepts['max_height'],
+                      invert=(player == PLAYER2))
+        return self.play_board(board, player, step, time_left)
 
-        action = self.h_alphabeta_search(board)[1]
+    def play_delta(self, action, key, player, step, time_left):
+        """Play in delta-percept mode (see Agent.play_delta), searching the
+        board kept for player by initialize instead of building it again."""
+        if player not in self.views:
+            return super().play_delta(action, key, player, step, time_left)
+        print("last action:", action)
+        print("player:", player)
+        print("step:", step)
+        print("time left:", time_left if time_left else '+inf')
+        board = self.apply_delta(action, key, player)
+        view = self.views[player]
+        if action is not None:
+            view.play_action(tuple(action))
+        result = self.play_board(view, player, step, time_left)
+        board.play_action(tuple(result))
+        view.play_action(tuple(result))
+        return result
+
+    def play_board(self, board, player, step, time_left):
+        """Return the action to play on board, the position seen from
+        yellow (see play).  board is left unchanged."""
+        self.stop_pondering()
+        self.start_move(step)
+        stats = self.stats = SearchStats(step, player)
+        deadline = None
+        if time_left is not None:
+            deadline = time.perf_counter() + \
+                self.get_move_budget(board, time_left)
+        # initialize is not always called by the game
+        self.open_book()
+        action = None
+        if self.book is not None:
+            action = self.book.lookup(board)
+            if action is not None:
+                print("book action")
+                stats.source = "book"
+        if action is None and \
+                board.get_movable_count() <= self.endgame_towers:
+            try:
+                value, action = self.solver.solve(board, deadline)
+                print("solved: score", value, "nodes", self.solver.nodes)
+                stats.source = "endgame"
+                stats.add_depth(None, self.solver.nodes, value, action)
+            except SolverTimeout:
+                print("endgame not solved in time")
+            stats.add_counts(self.solver.nodes, 0, 0, 0)
+        if action is None and self.workers > 1:
+            stats.source = "parallel"
+            action = self.parallel_deepening(board, step, deadline)
+        elif action is None:
+            action = self.iterative_deepening(board, deadline,
+                                              heuristic=self.get_evaluator())
+            print("Transposition table:", self.table)
+            print("Move ordering:", self.ordering)
+            if isinstance(self.evaluate, EvaluationCache):
+                print("Evaluation cache:", self.evaluate)
+            stats.add_counts(self.nodes, self.leaves, self.ordering.cutoffs,
+                             self.ordering.first_cutoffs)
+            stats.pv = self.get_principal_variation(board)
+        stats.action = action
+        self.write_stats(stats)
+        self.stats = None
+        if self.ponder and self.workers == 1 and action is not None:
+            board = board.clone()
+            board.play_action(action)
+            self.start_pondering(board)
         print("Action played:", action)
         return action
 
+    def write_stats(self, stats):
+        """Append stats to self.stats_file."""
+        if self.stats_file is None:
+            return
+        if self.stats_sink is None:
+            if self.stats_file == "-":
+                self.stats_sink = sys.stdout
+            else:
+                self.stats_sink = open(self.stats_file, "a")
+        stats.write(self.stats_sink)
+
+    def get_principal_variation(self, board, length=64):
+        """Return the actions expected from board, following the best
+        actions of the transposition table."""
+        pv = []
+        undos = []
+        while len(pv) < length:
+            action = self.get_table_action(board)
+            if action is None:
+                break
+            pv.append(action)
+            undos.append(board.play_action(action))
+        while undos:
+            board.undo_action(undos.pop())
+        return pv
+
+    def start_pondering(self, board):
+        """Search the positions following the likely replies to our last
+        action in a background thread, until stop_pondering is called.
+
+        board is the position after our action.  The results are kept in
+        the transposition table, where the search of the next move finds
+        them.  The self.ponder_replies most likely replies are searched in
+        turn with increasing depth.
+        """
+        if board.is_finished():
+            return
+        first = self.get_table_action(board)
+        replies = list(itertools.islice(
+            self.ordering.actions(board, PLAYER2, 1, first),
+            self.ponder_replies))
+        towers = board.get_tower_count(PLAYER1) + \
+            board.get_tower_count(PLAYER2)
+
+        def ponder():
+            depth = 1
+            try:
+                while depth < towers - 1:
+                    for reply in replies:
+                        undo = board.play_action(reply)
+                        try:
+                            self.h_alphabeta_search(board, depth,
+                                                    self.get_evaluator())
+                        finally:
+                            board.undo_action(undo)
+                    depth += 1
+            except SearchTimeout:
+                pass
+
+        self.stop.clear()
+        self.ponder_thread = threading.Thread(target=ponder, daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the search started by start_pondering, if any."""
+        if self.ponder_thread is not None:
+            self.stop.set()
+            self.ponder_thread.join()
+            self.ponder_thread = None
+            self.stop.clear()
+            print("pondered nodes:", self.nodes)
+
+    def get_evaluator(self):
+        """Return self.heuristic, wrapped in an EvaluationCache kept for
+        the whole game if self.eval_cache_size is positive."""
+        if self.evaluate is None:
+            if self.eval_cache_size > 0:
+                self.evaluate = EvaluationCache(self.heuristic,
+                                                self.eval_cache_size)
+            else:
+                self.evaluate = self.heuristic
+        return self.evaluate
+
+    def get_table_action(self, board):
+        """Return the best action of board stored in the transposition
+        table, or None."""
+        key, s = board.get_canonical_hash()
+        entry = self.table.probe(key)
+        if entry is None or entry[3] is None:
+            return None
+        layout = board.get_layout()
+        action = layout.transform_action(layout.inverses[s],
+                                         layout.decode_action(entry[3]))
+        return action if board.is_action_valid(action) else None
+
+    def start_move(self, step):
+        """Prepare the search tables for the move of step step."""
+        if self.table is None:
+            self.table = TranspositionTable(self.table_size)
+        elif step <= self.last_step:
+            # a new game has started
+            self.table.clear()
+        if step != self.last_step:
+            self.table.new_search()
+            self.ordering.new_search()
+            self.nodes = 0
+            self.leaves = 0
+        self.last_step = step
+
+    def get_move_budget(self, board, time_left):
+        """Return the number of seconds to spend on the next move.
+
+        The time left is shared between the moves we still expect to play.
+        Every action removes a tower and the game goes on while some towers
+        can move, so about a third of the movable towers gives our number of
+        remaining moves.
+        """
+        moves = max(self.min_moves, board.get_movable_count() // 3)
+        return max(0.0, time_left - self.margin) / moves
+
+    def iterative_deepening(self, board, deadline=None, max_depth=None,
+                            heuristic=lambda board : board.get_score()):
+        """Search deeper and deeper until deadline and return the best action
+        of the last completed depth.
+
+        deadline is a time.perf_counter() value, or None to search up to
+        max_depth (self.untimed_depth by default).  The search also stops
+        once a depth has been searched without reaching the cutoff, i.e. the
+        whole game tree has been explored, or when it exceeds the number of
+        actions that can still be played.
+        """
+        if deadline is None and max_depth is None:
+            max_depth = self.untimed_depth
+        # every action removes a tower: a game cannot last longer
+        towers = board.get_tower_count(PLAYER1) + \
+            board.get_tower_count(PLAYER2)
+        best_action = next(board.get_actions(), None)
+        depth = 1
+        while (max_depth is None or depth <= max_depth) and depth < towers:
+            nodes = self.nodes
+            try:
+                value, action, reached = self.h_alphabeta_search(
+                    board, depth, heuristic, deadline)
+            except SearchTimeout:
+                break
+            if action is not None:
+                best_action = action
+            print("depth:", depth, "value:", value, "action:", best_action)
+            if self.stats is not None:
+                self.stats.add_depth(depth, self.nodes - nodes, value,
+                                     best_action)
+            if not reached:
+                break
+            depth += 1
+        return best_action
+
+    def parallel_deepening(self, board, step, deadline=None, max_depth=None):
+        """Search as iterative_deepening does, with self.workers processes.
+
+        The root is split: at each depth, the best action of the previous
+        depth is searched first, then the other actions are searched by the
+        processes of self.pool with the best value found so far as alpha, so
+        that they only prove that they are not better (see _search_root_action).
+        Each process keeps its own transposition table from one task to the
+        next.  The depth is complete when all the actions have been searched;
+        if the deadline interrupts it, an action already proven better than
+        the best one of the previous depth is still played.
+        """
+        if self.pool is None:
+            self.alpha = multiprocessing.Value("d", -math.inf)
+            self.pool = multiprocessing.Pool(self.workers,
+                                             initializer=_init_worker,
+                                             initargs=(self.table_size,
+                                                       self.eval_cache_size,
+                                                       self.alpha))
+        if deadline is None and max_depth is None:
+            max_depth = self.untimed_depth
+        # the processes do not share time.perf_counter()
+        wall_deadline = None
+        if deadline is not None:
+            wall_deadline = time.time() + deadline - time.perf_counter()
+        towers = board.get_tower_count(PLAYER1) + \
+            board.get_tower_count(PLAYER2)
+        actions = list(board.get_actions())
+        best_action = actions[0] if actions else None
+        nodes = {}
+        depth = 1
+        while (max_depth is None or depth <= max_depth) and depth < towers:
+            values = {}
+            result = {"reached": False, "nodes": 0, "best": None,
+                      "value": -math.inf, "pv": []}
+
+            def search(root_actions, alpha):
+                """Search root_actions at depth depth with alpha (None for
+                no bound) and record their results."""
+                tasks = [(board.m, board.max_height, action, depth,
+                          wall_deadline, step, alpha)
+                         for action in root_actions]
+                results = self.pool.imap_unordered(_search_root_action, tasks)
+                for k in range(len(tasks)):
+                    timeout = None
+                    if deadline is not None:
+                        timeout = max(0.0, deadline - time.perf_counter()) + \
+                            self.margin / 2
+                    pid, action, value, r, counts, pv = results.next(timeout)
+                    nodes[pid] = nodes.get(pid, 0) + counts[0]
+                    result["nodes"] += counts[0]
+                    if self.stats is not None:
+                        self.stats.add_counts(*counts)
+                    if value is None:
+                        raise SearchTimeout
+                    values[action] = value
+                    result["reached"] = result["reached"] or r
+                    if value > result["value"]:
+                        result.update(best=action, value=value, pv=pv)
+                        with self.alpha.get_lock():
+                            self.alpha.value = max(self.alpha.value, value)
+
+            try:
+                # the best action first, then the others with its value as
+                # alpha: their values not above alpha are upper bounds
+                search(actions[:1], None)
+                self.alpha.value = result["value"]
+                search(actions[1:], result["value"])
+            except (SearchTimeout, multiprocessing.TimeoutError):
+                if result["best"] not in (None, actions[0]):
+                    # proven better than the first action at this depth
+                    best_action = result["best"]
+                    if self.stats is not None:
+                        self.stats.pv = result["pv"]
+                break
+            best_action = result["best"]
+            actions.remove(best_action)
+            # sort is stable: on ties, keep the previous order
+            actions.sort(key=lambda a: -values[a])
+            actions.insert(0, best_action)
+            print("depth:", depth, "value:", result["value"], "action:",
+                  best_action)
+            if self.stats is not None:
+                self.stats.add_depth(depth, result["nodes"], result["value"],
+                                     best_action)
+                self.stats.pv = result["pv"]
+            if not result["reached"]:
+                break
+            depth += 1
+        print("Nodes per worker:", ", ".join(
+            "%d: %d" % (pid, n) for pid, n in sorted(nodes.items())))
+        return best_action
+
     def h_alphabeta_search(
         self,
         board,
-        cutoff=lambda board, depth: depth > 2,
-        heuristic=lambda board : board.get_score()
+        depth=3,
+        heuristic=lambda board : board.get_score(),
+        deadline=None,
+        root_actions=None,
+        alpha=-math.inf
     ):
-        """Search game to determine best action; use alpha-beta pruning."""
+        """Search game to determine best action; use alpha-beta pruning.
+
+        The positions depth actions away from board are evaluated with
+        heuristic.  Return a triplet (value, action, reached) where reached
+        tells whether that depth has been reached, i.e. whether a deeper
+        search could give a different result.
 
-        def max_value(board, alpha, beta, depth):
+        The actions are played and undone on board itself, which is left
+        unchanged on return.  The results are stored in self.table, keyed by
+        the canonical key of the positions.  If deadline (a
+        time.perf_counter() value) is reached or self.stop is set, raise
+        SearchTimeout.
+
+        If root_actions is given, only these actions are searched from board,
+        in this order.  alpha is the lower bound of the window of the root:
+        a value at most alpha is only an upper bound of the true value.
+        """
+        table = self.table
+        ordering = self.ordering
+        layout = board.get_layout()
+        reached = [False]
+
+        def check_deadline():
+            self.nodes += 1
+            if self.nodes % self.check_interval == 0 and \
+                    (self.stop.is_set() or deadline is not None and
+                     time.perf_counter() >= deadline):
+                raise SearchTimeout
+
+        def probe(board, alpha, beta, ply):
+            """Return (key, symmetry, value, action) from the table; value
+            is None unless it decides the search of board."""
+            key, s = board.get_canonical_hash()
+            entry = table.probe(key)
+            if entry is None:
+                return (key, s, None, None)
+            d, bound, value, code = entry
+            action = None
+            if code is not None:
+                action = layout.transform_action(layout.inverses[s],
+                                                 layout.decode_action(code))
+                if not board.is_action_valid(action):
+                    return (key, s, None, None)
+            if ply > 0 and d >= depth - ply and \
+                    (bound == EXACT or
+                     (bound == LOWER and value >= beta) or
+                     (bound == UPPER and value <= alpha)):
+                # the stored search may have reached its own cutoff
+                reached[0] = True
+                return (key, s, value, action)
+            return (key, s, None, action)
+
+        def store(key, s, alpha, beta, ply, value, action):
+            if value <= alpha:
+                bound = UPPER
+            elif value >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            code = None
+            if action is not None:
+                code = layout.encode_action(layout.transform_action(s, action))
+            table.store(key, depth - ply, bound, value, code)
+
+        def max_value(board, alpha, beta, ply):
+            check_deadline()
             if (board.is_finished()):
-                return (board.get_score())
+                self.leaves += 1
+                return (board.get_score(), None)
 
-            if (cutoff(board, depth)):
+            if (ply >= depth):
+                reached[0] = True
+                self.leaves += 1
                 return (heuristic(board), None)
-            
+
+            key, s, value, first = probe(board, alpha, beta, ply)
+            if value is not None:
+                return (value, first)
+
             best_value = - math.inf
             best_action = None
-            for action in board.get_actions():
-                new_board = board.clone()
-                child_value = min_value(new_board, alpha, beta, depth+1)[0]
+            alpha_start = alpha
+            if ply == 0 and root_actions is not None:
+                actions = root_actions
+            else:
+                actions = ordering.actions(board, PLAYER1, ply, first)
+            for index, action in enumerate(actions):
+                undo = board.play_action(action)
+                try:
+                    child_value = min_value(board, alpha, beta, ply+1)[0]
+                finally:
+                    board.undo_action(undo)
                 if (child_value > best_value):
                     best_value = child_value
                     best_action = action
                     alpha = max(alpha, best_value)
                     if (alpha >= beta):
+                        ordering.add_cutoff(action, ply, depth - ply, index)
                         break
+            if ply > 0 or root_actions is None:
+                store(key, s, alpha_start, beta, ply, best_value, best_action)
             return (best_value, best_action)
 
-        def min_value(board, alpha, beta, depth):
+        def min_value(board, alpha, beta, ply):
+            check_deadline()
             if (board.is_finished()):
-                return (board.get_score())
+                self.leaves += 1
+                return (board.get_score(), None)
 
-            if (cutoff(board, depth)):
+            if (ply >= depth):
+                reached[0] = True
+                self.leaves += 1
                 return (heuristic(board), None)
-            
+
+            key, s, value, first = probe(board, alpha, beta, ply)
+            if value is not None:
+                return (value, first)
+
             best_value = math.inf
             best_action = None
-            for action in board.get_actions():
-                new_board = board.clone()
-                child_value = max_value(new_board, alpha, beta, depth+1)[0]
+            beta_start = beta
+            actions = ordering.actions(board, PLAYER2, ply, first)
+            for index, action in enumerate(actions):
+                undo = board.play_action(action)
+                try:
+                    child_value = max_value(board, alpha, beta, ply+1)[0]
+                finally:
+                    board.undo_action(undo)
                 if (child_value < best_value):
                     best_value = child_value
                     best_action = action
                     beta = min(beta, best_value)
                     if (alpha >= beta):
+                        ordering.add_cutoff(action, ply, depth - ply, index)
                         break
+            store(key, s, alpha, beta_start, ply, best_value, best_action)
             return (best_value, best_action)
 
-        return max_value(board, -math.inf, math.inf, 0)
+        value, action = max_value(board, alpha, math.inf, 0)
+        return (value, action, reached[0])
+
+
+# agent of a worker process of MyAgent.parallel_deepening
+_worker_agent = None
+
+# best value of the actions of the current depth, shared with the workers
+_worker_alpha = None
+
+
+def _init_worker(table_size, eval_cache_size, alpha):
+    global _worker_agent, _worker_alpha
+    _worker_alpha = alpha
+    _worker_agent = MyAgent()
+    _worker_agent.table_size = table_size
+    _worker_agent.eval_cache_size = eval_cache_size
+
+
+def _search_root_action(task):
+    """Search one root action in a worker process.
+
+    If the alpha of the task is not None, the action is searched with the
+    larger of it and the shared _worker_alpha as alpha.  Return a tuple
+    (pid, action, value, reached, counts, pv), where value is None if the
+    deadline has been reached, counts gives the numbers of nodes, leaves,
+    cutoffs and first-action cutoffs of the search and pv is the principal
+    variation starting with action.
+    """
+    percepts, max_height, action, depth, deadline, step, alpha = task
+    agent = _worker_agent
+    if step != agent.last_step:
+        agent.start_move(step)
+    start = (agent.nodes, agent.leaves, agent.ordering.cutoffs,
+             agent.ordering.first_cutoffs)
+    if deadline is not None:
+        deadline = time.perf_counter() + deadline - time.time()
+    if alpha is None:
+        alpha = -math.inf
+    else:
+        alpha = max(alpha, _worker_alpha.value)
+    board = Board(percepts, max_height)
+    pv = []
+    try:
+        value, _, reached = agent.h_alphabeta_search(
+            board, depth, agent.get_evaluator(), deadline=deadline,
+            root_actions=[action], alpha=alpha)
+        board.play_action(action)
+        pv = [action] + agent.get_principal_variation(board)
+    except SearchTimeout:
+        value, reached = None, True
+    counts = (agent.nodes - start[0], agent.leaves - start[1],
+              agent.ordering.cutoffs - start[2],
+              agent.ordering.first_cutoffs - start[3])
+    return (os.getpid(), action, value, reached, counts, pv)
+
+
+def add_arguments(agent, parser):
+    """Add the options of MyAgent to parser (see agent_main)."""
+    parser.add_argument("--hash", type=float, default=agent.table_size,
+                        help="size of the transposition table in MB" +
+                             " (default: %(default)s)",
+                        metavar="MB")
+    parser.add_argument("--workers", type=int, default=agent.workers,
+                        help="number of processes searching in parallel" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--ponder", action="store_true", default=False,
+                        help="keep searching while the opponent thinks")
+    parser.add_argument("--endgame", type=int, default=agent.endgame_towers,
+                        help="solve the game exactly from N movable towers" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--eval-cache", type=int,
+                        default=agent.eval_cache_size,
+                        help="number of evaluations to cache, 0 to disable" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--stats", default=agent.stats_file,
+                        help="append the search statistics of each move as" +
+                             " JSON lines to FILE, - for the standard" +
+                             " output (mixed with the other messages of" +
+                             " the agent)",
+                        metavar="FILE")
+    parser.add_argument("--book",
+                        help="opening book built by book.py",
+                        metavar="FILE")
+
+
+def setup(agent, parser, args):
+    """Configure agent from the options of add_arguments."""
+    if args.hash <= 0:
+        parser.error("the transposition table size must be positive")
+    if args.workers < 1:
+        parser.error("the number of workers must be positive")
+    agent.table_size = args.hash
+    agent.workers = args.workers
+    agent.ponder = args.ponder
+    agent.endgame_towers = args.endgame
+    agent.book_file = args.book
+    agent.stats_file = args.stats
+    if args.eval_cache < 0:
+        parser.error("the evaluation cache size cannot be negative")
+    agent.eval_cache_size = args.eval_cache
+
 
 if __name__ == "__main__":
-    agent_main(MyAgent())
+    agent_main(MyAgent(), add_arguments, setup)
 
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Binary protocol between the Avalam game and the agents.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+The protocol carries the same calls as XML-RPC over one persistent stream
+socket (TCP or Unix).  The client opens the connection by sending MAGIC,
+which the server echoes.  The calls and their results are then exchanged as
+frames: a 4-byte little-endian length followed by the payload, whose first
+byte gives the type of the message.
+
+client to server:
+    'P' play: player (int8), step (uint32), time_left (float64, NaN for
+        None), then the board
+    'I' initialize: time_left, the number of players (uint8), the players
+        (int8 each), then the board
+    'D' play_delta: player, step, time_left, whether there is an action
+        (uint8), the action (i1, j1, i2, j2 as int8), the key (uint64)
+
+    where the board is made of rows, columns, max_height (uint8) followed
+    by one int8 per cell
+
+server to client:
+    'A' action: i1, j1, i2, j2 (int8)
+    'N' no action (None)
+    'E' error: the message in UTF-8
+
+Since the server peeks at the first bytes of each connection, an agent
+server speaks both protocols on the same port, and a client falls back to
+XML-RPC when the server does not echo MAGIC.
+
+"""
+import math
+import socket
+import socketserver
+import struct
+import threading
+import urllib.parse
+import xmlrpc.client
+from xmlrpc.server import SimpleXMLRPCDispatcher, SimpleXMLRPCRequestHandler, \
+    SimpleXMLRPCServer
+
+MAGIC = b"AVBIN1\r\n"
+
+LENGTH = struct.Struct("<I")
+BOARD = struct.Struct("<BBB")
+PLAY = struct.Struct("<cbId")
+INITIALIZE = struct.Struct("<cdB")
+DELTA = struct.Struct("<cbIdB4bQ")
+ACTION = struct.Struct("<c4b")
+
+# seconds allowed to the server to answer the handshake, and to the client
+# to send its first bytes
+HANDSHAKE_TIMEOUT = 5.0
+
+
+def recv_exactly(sock, size):
+    """Return size bytes read from sock, raising EOFError if the connection
+    is closed first."""
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError("connection closed")
+        data += chunk
+    return bytes(data)
+
+
+def send_frame(sock, payload):
+    """Send one frame holding payload."""
+    sock.sendall(LENGTH.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    """Return the payload of the next frame received on sock."""
+    size, = LENGTH.unpack(recv_exactly(sock, LENGTH.size))
+    return recv_exactly(sock, size)
+
+
+def encode_time(time_left):
+    """Return time_left as sent, NaN standing for None."""
+    return math.nan if time_left is None else time_left
+
+
+def decode_time(time_left):
+    """Return the time_left sent as time_left."""
+    return None if math.isnan(time_left) else time_left
+
+
+def encode_board(board):
+    """Return the encoding of board (a Board or the percepts dictionary
+    received through XML-RPC)."""
+    if isinstance(board, dict):
+        m, max_height = board['m'], board['max_height']
+    else:
+        m, max_height = board.m, board.max_height
+    return BOARD.pack(len(m), len(m[0]), max_height) + \
+        bytes([x & 0xFF for row in m for x in row])
+
+
+def decode_board(payload, offset):
+    """Return the board encoded in payload at offset, as the percepts
+    dictionary received through XML-RPC."""
+    rows, columns, max_height = BOARD.unpack_from(payload, offset)
+    offset += BOARD.size
+    cells = memoryview(payload)[offset:offset + rows * columns] \
+        .cast("b").tolist()
+    m = [cells[k:k + columns] for k in range(0, rows * columns, columns)]
+    return {'m': m, 'max_height': max_height}
+
+
+def encode_play(board, player, step, time_left):
+    """Return the payload of a play call."""
+    return PLAY.pack(b"P", player, step, encode_time(time_left)) + \
+        encode_board(board)
+
+
+def decode_play(payload):
+    """Return the arguments (percepts, player, step, time_left) of the play
+    call encoded in payload."""
+    kind, player, step, time_left = PLAY.unpack_from(payload)
+    return (decode_board(payload, PLAY.size), player, step,
+            decode_time(time_left))
+
+
+def encode_initialize(board, players, time_left):
+    """Return the payload of an initialize call."""
+    return INITIALIZE.pack(b"I", encode_time(time_left), len(players)) + \
+        bytes([p & 0xFF for p in players]) + encode_board(board)
+
+
+def decode_initialize(payload):
+    """Return the arguments (percepts, players, time_left) of the
+    initialize call encoded in payload."""
+    kind, time_left, count = INITIALIZE.unpack_from(payload)
+    offset = INITIALIZE.size
+    players = memoryview(payload)[offset:offset + count].cast("b").tolist()
+    return (decode_board(payload, offset + count), players,
+            decode_time(time_left))
+
+
+def encode_delta(action, key, player, step, time_left):
+    """Return the payload of a play_delta call."""
+    return DELTA.pack(b"D", player, step, encode_time(time_left),
+                      action is not None,
+                      *(action if action is not None else (0, 0, 0, 0)),
+                      int(key, 16))
+
+
+def decode_delta(payload):
+    """Return the arguments (action, key, player, step, time_left) of the
+    play_delta call encoded in payload."""
+    kind, player, step, time_left, has_action, i1, j1, i2, j2, key = \
+        DELTA.unpack(payload)
+    action = (i1, j1, i2, j2) if has_action else None
+    return (action, "%x" % key, player, step, decode_time(time_left))
+
+
+# decoder and method of each type of call
+CALLS = {b"P": (decode_play, "play"),
+         b"I": (decode_initialize, "initialize"),
+         b"D": (decode_delta, "play_delta")}
+
+
+def encode_result(action):
+    """Return the payload of the result action of a call (None for
+    initialize)."""
+    if action is None:
+        return b"N"
+    return ACTION.pack(b"A", *action)
+
+
+def decode_result(payload):
+    """Return the action encoded in payload, raising xmlrpc.client.Fault if
+    the call has failed on the agent side."""
+    kind = payload[:1]
+    if kind == b"A":
+        return tuple(ACTION.unpack(payload)[1:])
+    if kind == b"N":
+        return None
+    if kind == b"E":
+        raise xmlrpc.client.Fault(1, payload[1:].decode("utf-8", "replace"))
+    raise xmlrpc.client.Fault(1, "unknown message type %r" % kind)
+
+
+class AgentRequestHandler(SimpleXMLRPCRequestHandler):
+
+    """Handle a connection speaking either the binary protocol or
+    XML-RPC."""
+
+    def handle(self):
+        try:
+            self.request.settimeout(HANDSHAKE_TIMEOUT)
+            head = self.request.recv(len(MAGIC),
+                                     socket.MSG_PEEK | socket.MSG_WAITALL)
+            self.request.settimeout(self.timeout)
+        except OSError:
+            return
+        if head != MAGIC:
+            super().handle()
+            return
+        sock = self.request
+        recv_exactly(sock, len(MAGIC))
+        sock.sendall(MAGIC)
+        while True:
+            try:
+                payload = recv_frame(sock)
+            except (EOFError, OSError):
+                return
+            try:
+                if payload[:1] not in CALLS:
+                    raise ValueError("unknown message type %r" %
+                                     payload[:1])
+                decode, method = CALLS[payload[:1]]
+                action = self.server._dispatch(method, decode(payload))
+                result = encode_result(action)
+            except Exception as e:
+                result = b"E" + ("%s: %s" % (type(e).__name__, e)).encode()
+            try:
+                send_frame(sock, result)
+            except OSError:
+                return
+
+
+class SerialDispatchMixIn:
+
+    """Mix-in class serialising the calls to the agent of a server handling
+    each connection in its own thread: a binary session stays open for a
+    whole game, so other clients must be served meanwhile, but the agent
+    only plays one call at a time, as with a single-threaded server."""
+
+    daemon_threads = True
+
+    def _dispatch(self, method, params):
+        with self.dispatch_lock:
+            return super()._dispatch(method, params)
+
+
+class AgentServer(SerialDispatchMixIn, socketserver.ThreadingMixIn,
+                  SimpleXMLRPCServer):
+
+    """Agent server listening on a TCP address (see AgentRequestHandler)."""
+
+    def __init__(self, address):
+        self.dispatch_lock = threading.Lock()
+        SimpleXMLRPCServer.__init__(self, address,
+                                    requestHandler=AgentRequestHandler,
+                                    allow_none=True)
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+
+    class UnixAgentRequestHandler(AgentRequestHandler):
+
+        """AgentRequestHandler for Unix sockets, which have no Nagle
+        algorithm to disable."""
+
+        disable_nagle_algorithm = False
+
+    class UnixAgentServer(SerialDispatchMixIn, socketserver.ThreadingMixIn,
+                          socketserver.UnixStreamServer,
+                          SimpleXMLRPCDispatcher):
+
+        """Agent server listening on a Unix socket (see AgentRequestHandler).
+        """
+
+        def __init__(self, path):
+            self.dispatch_lock = threading.Lock()
+            self.logRequests = False
+            SimpleXMLRPCDispatcher.__init__(self, allow_none=True)
+            socketserver.UnixStreamServer.__init__(self, path,
+                                                   UnixAgentRequestHandler)
+
+
+class BinaryAgentProxy:
+
+    """Proxy for a remote agent speaking the binary protocol.
+
+    The proxy keeps one connection for all the calls.  As with
+    xmlrpc.client.ServerProxy, each call waits for at most the default
+    socket timeout (see socket.setdefaulttimeout) and raises socket.timeout
+    beyond it; the connection is then closed, since a late answer would
+    break the stream.
+
+    """
+
+    def __init__(self, sock):
+        """Wrap sock, a connected socket on which the handshake is done."""
+        self.sock = sock
+
+    @classmethod
+    def connect(cls, uri):
+        """Connect to the agent server at uri and return a proxy, or None if
+        the server does not speak the binary protocol.
+
+        uri is either an http:// URI as with XML-RPC or unix:PATH.
+        """
+        parts = urllib.parse.urlsplit(uri)
+        try:
+            if parts.scheme == "unix":
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(HANDSHAKE_TIMEOUT)
+                sock.connect(parts.path)
+            else:
+                sock = socket.create_connection(
+                    (parts.hostname or "localhost", parts.port or 80),
+                    HANDSHAKE_TIMEOUT)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            return None
+        try:
+            sock.sendall(MAGIC)
+            if recv_exactly(sock, len(MAGIC)) != MAGIC:
+                sock.close()
+                return None
+        except (OSError, EOFError):
+            sock.close()
+            return None
+        return cls(sock)
+
+    def initialize(self, board, players, time_left):
+        return self.call(encode_initialize(board, players, time_left))
+
+    def play(self, board, player, step, time_left):
+        return self.call(encode_play(board, player, step, time_left))
+
+    def play_delta(self, action, key, player, step, time_left):
+        return self.call(encode_delta(action, key, player, step, time_left))
+
+    def call(self, request):
+        """Send the payload request of a call and return its result."""
+        if self.sock is None:
+            raise socket.error("connection closed")
+        self.sock.settimeout(socket.getdefaulttimeout())
+        try:
+            send_frame(self.sock, request)
+            payload = recv_frame(self.sock)
+        except socket.timeout:
+            self.close()
+            raise
+        except EOFError as e:
+            self.close()
+            raise socket.error(str(e))
+        return decode_result(payload)
+
+    def close(self):
+        """Close the connection."""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
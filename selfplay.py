@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Self-play generation of training positions for the Avalam evaluators.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import contextlib
+import glob
+import io
+import mmap
+import multiprocessing
+import os
+import random
+import math
+import struct
+
+from avalam import *
+from game import load_agent
+
+MAGIC = b"AVSELF1\0"
+
+# rows, columns, maximum height of the towers
+HEADER = struct.Struct("<BBB")
+
+
+def get_record_struct(rows, columns):
+    """Return the Struct of a record for boards of rows x columns cells:
+    board (one signed byte per cell), player to move, search value and
+    final score."""
+    return struct.Struct("<%dsbfb" % (rows * columns))
+
+
+class ShardWriter:
+
+    """Append records to a shard file.
+
+    A record holds a position seen from the player to move (whose towers
+    are positive, as in the boards built by the agents), that player, the
+    value of the position found by the search (NaN if the agent gives
+    none) and the final score of the game, both also for the player to
+    move.
+
+    """
+
+    def __init__(self, filename, rows, columns, max_height=Board.max_height):
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC + HEADER.pack(rows, columns, max_height))
+        self.record = get_record_struct(rows, columns)
+        self.count = 0
+
+    def write(self, board, player, value, result):
+        """Append a record; board is a BoardSnapshot."""
+        self.file.write(self.record.pack(board.data, player, value, result))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ShardReader:
+
+    """Read-only access to a shard file.
+
+    The file is memory-mapped: the records are decoded on access, so that
+    iterating over a shard does not load it in memory.  Each record is a
+    tuple (board, player, value, result) where board is a BoardSnapshot (see
+    ShardWriter).
+
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            self.file.close()
+            raise ValueError("%s is not a self-play shard" % filename)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("%s is not a self-play shard" % filename)
+        self.rows, self.columns, self.max_height = \
+            HEADER.unpack_from(self.map, len(MAGIC))
+        self.record = get_record_struct(self.rows, self.columns)
+        self.offset = len(MAGIC) + HEADER.size
+        self.count = (len(self.map) - self.offset) // self.record.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("record index out of range")
+        data, player, value, result = self.record.unpack_from(
+            self.map, self.offset + index * self.record.size)
+        return (BoardSnapshot(data, self.rows, self.columns, self.max_height),
+                player, value, result)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def as_array(self):
+        """Return the records as a NumPy structured array mapped on the
+        file, with the fields board (int8, rows x columns), player, value
+        and result."""
+        import numpy as np
+        dtype = np.dtype([("board", "i1", (self.rows, self.columns)),
+                          ("player", "i1"), ("value", "<f4"),
+                          ("result", "i1")])
+        return np.frombuffer(self.map, dtype, self.count, self.offset)
+
+    def close(self):
+        """Close the shard file."""
+        self.map.close()
+        self.file.close()
+
+
+def read_shards(directory):
+    """Yield all the records of the shards of directory, one shard after
+    the other."""
+    for filename in sorted(glob.glob(os.path.join(directory, "*.shard"))):
+        reader = ShardReader(filename)
+        try:
+            yield from reader
+        finally:
+            reader.close()
+
+
+def search_position(agent, view, step, depth):
+    """Return a pair (value, action) for the player to move on view, who
+    plays yellow.
+
+    Agents with a depth-limited search (h_alphabeta_search and start_move,
+    as MyAgent) search view at depth depth.  Other agents are asked to play
+    with no time limit, and the value is NaN.
+    """
+    if hasattr(agent, "h_alphabeta_search"):
+        agent.start_move(step)
+        value, action, reached = agent.h_alphabeta_search(view, depth)
+        return (value, action)
+    action = agent.play({'m': view.get_percepts(),
+                         'max_height': view.max_height},
+                        PLAYER1, step, None)
+    return (math.nan, tuple(action))
+
+
+def play_selfplay_game(agents, depth, random_plies=0, epsilon=0.0,
+                       rng=random):
+    """Play one game between agents, a pair of agents for player 1 and
+    player 2, and return its records as a list of tuples
+    (board, player, value, result) (see ShardWriter).
+
+    The positions are searched with search_position at depth depth.  The
+    first random_plies actions are random, then a random action is played
+    instead of the best one with probability epsilon.  Each player should
+    have its own agent instance, so that the tables of an agent always see
+    the positions from the same side.
+    """
+    board = Board()
+    positions = []
+    player = PLAYER1
+    step = 0
+    while not board.is_finished():
+        step += 1
+        if step <= random_plies:
+            action = rng.choice(list(board.get_actions()))
+        else:
+            view = Board(board.m, board.max_height,
+                         invert=(player == PLAYER2))
+            agent = agents[0 if player == PLAYER1 else 1]
+            value, action = search_position(agent, view, step, depth)
+            positions.append((view.snapshot(), player, value))
+            if rng.random() < epsilon:
+                action = rng.choice(list(board.get_actions()))
+        board.play_action(action)
+        player = -player
+    score = board.get_score()
+    return [(snapshot, player, value, score * player)
+            for snapshot, player, value in positions]
+
+
+def generate(task):
+    """Play games and write their records to the shards of one worker.
+
+    task is a tuple (directory, worker, games, shard_size, specs, depth,
+    random_plies, epsilon, seed), specs being the agent specs of player 1
+    and player 2 (see game.load_agent).  The records are written as soon
+    as each game ends, to shards of at most shard_size records named
+    selfplay-WORKER-INDEX.shard.  Return the number of records written.
+    """
+    directory, worker, games, shard_size, specs, depth, random_plies, \
+        epsilon, seed = task
+    rng = random.Random(seed)
+    random.seed(seed)  # for the agents playing at random
+    agents = [load_agent(spec) for spec in specs]
+    layout = Board()
+    writer = None
+    shards = 0
+    total = 0
+    try:
+        for game in range(games):
+            with contextlib.redirect_stdout(io.StringIO()):
+                records = play_selfplay_game(agents, depth, random_plies,
+                                             epsilon, rng)
+            for record in records:
+                if writer is None or writer.count >= shard_size:
+                    if writer is not None:
+                        writer.close()
+                    filename = os.path.join(
+                        directory,
+                        "selfplay-%03d-%05d.shard" % (worker, shards))
+                    writer = ShardWriter(filename, layout.rows,
+                                         layout.columns, layout.max_height)
+                    shards += 1
+                writer.write(*record)
+                total += 1
+    finally:
+        if writer is not None:
+            writer.close()
+    return total
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Generate training positions by self-play.")
+    parser.add_argument("directory", help="directory of the shards to write",
+                        metavar="DIR")
+    parser.add_argument("-a", "--agent", default="my_player:MyAgent",
+                        help="agent class of player 1, as module:Class" +
+                             " (default: %(default)s)")
+    parser.add_argument("--opponent",
+                        help="agent class of player 2 (default: same as" +
+                             " player 1)",
+                        metavar="AGENT")
+    parser.add_argument("-g", "--games", type=int, default=100,
+                        help="number of games (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--depth", type=int, default=2,
+                        help="depth of the search of each position, for" +
+                             " agents with h_alphabeta_search (default:" +
+                             " %(default)s)")
+    parser.add_argument("--random-plies", type=int, default=4,
+                        help="number of random actions opening each game" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--epsilon", type=float, default=0.05,
+                        help="probability of a random action after the" +
+                             " opening (default: %(default)s)")
+    parser.add_argument("--shard-size", type=int, default=100000,
+                        help="maximum number of records per shard" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("-j", "--processes", type=int,
+                        default=os.cpu_count(),
+                        help="number of worker processes, each writing its" +
+                             " own shards (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed (default: %(default)s)")
+    args = parser.parse_args()
+    if args.games < 1 or args.processes < 1 or args.shard_size < 1:
+        parser.error("the numbers of games, processes and records per" +
+                     " shard must be positive")
+
+    os.makedirs(args.directory, exist_ok=True)
+    workers = min(args.processes, args.games)
+    specs = (args.agent, args.opponent or args.agent)
+    tasks = [(args.directory, w, args.games // workers +
+              (w < args.games % workers), args.shard_size, specs,
+              args.depth, args.random_plies, args.epsilon,
+              args.seed * 1000 + w)
+             for w in range(workers)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        total = sum(pool.map(generate, tasks))
+    print("Wrote", total, "records of", args.games, "games to",
+          args.directory, "in %.1f s" % (time.perf_counter() - start))
@@ -0,0 +1,83 @@
+"""
+Tests of the delta-percept mode, with both colours played by one agent.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import contextlib
+import io
+import threading
+import unittest
+
+from avalam import *
+from game import Game, LocalAgent, connect_agent
+from my_player import MyAgent
+from protocol import AgentServer
+from random_player import RandomAgent
+
+
+class SharedAgentTest(unittest.TestCase):
+
+    def play(self, agents, credit=60.0):
+        """Play a delta-percept game between agents and return its trace."""
+        game = Game(agents, Board(), credits=[credit, credit], delta=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            game.play()
+        self.assertEqual(game.delta, [True, True])
+        return game.trace
+
+    def check_finished(self, trace):
+        self.assertEqual(trace.reason, "")
+        board = trace.get_initial_board()
+        for player, action, t in trace.actions:
+            board.play_action(action)
+        self.assertTrue(board.is_finished())
+
+    def serve(self, agent):
+        """Serve agent on a free port and return its URI."""
+        server = AgentServer(("127.0.0.1", 0))
+        server.logRequests = False
+        server.register_instance(agent)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:%d" % server.server_address[1]
+
+    def test_binary_server(self):
+        uri = self.serve(RandomAgent())
+        agents = [connect_agent(uri), connect_agent(uri)]
+        try:
+            self.check_finished(self.play(agents))
+        finally:
+            for agent in agents:
+                agent.close()
+
+    def test_xmlrpc_server(self):
+        uri = self.serve(RandomAgent())
+        self.check_finished(self.play([connect_agent(uri, False),
+                                       connect_agent(uri, False)]))
+
+    def test_my_agent(self):
+        agent = MyAgent()
+        agent.ponder = False
+        agent.untimed_depth = 1
+        agent.stats_file = None
+        agents = [LocalAgent("random_player:RandomAgent"),
+                  LocalAgent("random_player:RandomAgent")]
+        for local in agents:
+            local.agent = agent
+        self.check_finished(self.play(agents, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
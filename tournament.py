@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Headless tournaments between Avalam agents.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+import contextlib
+import io
+import math
+import multiprocessing
+import os
+import pickle
+import time
+
+from avalam import *
+from game import Game, LocalAgent
+
+
+def get_pairings(count, games, mode="round-robin"):
+    """Return the list of the games to play between count agents, as pairs
+    (first player, second player) of agent indices.
+
+    In mode "round-robin" every two agents meet, in mode "gauntlet" agent 0
+    meets each of the others.  Each pair of agents plays games games, with
+    alternating colours.
+    """
+    if mode == "round-robin":
+        pairs = [(i, j) for i in range(count) for j in range(i + 1, count)]
+    elif mode == "gauntlet":
+        pairs = [(0, j) for j in range(1, count)]
+    else:
+        raise ValueError("unknown tournament mode: %s" % mode)
+    return [(i, j) if k % 2 == 0 else (j, i)
+            for k in range(games) for i, j in pairs]
+
+
+def play_game(task):
+    """Play one game in-process and return (index, first, second, trace).
+
+    task is a tuple (index, specs, first, second, credit), where specs is
+    the list of the agent specs (see game.load_agent) and first and second
+    are the indices of the players.  The output of the agents is discarded.
+    """
+    index, specs, first, second, credit = task
+    with contextlib.redirect_stdout(io.StringIO()):
+        agents = [LocalAgent(specs[first]), LocalAgent(specs[second])]
+        game = Game(agents, Board(), credits=[credit, credit])
+        game.play()
+    return (index, first, second, game.trace)
+
+
+def elo_difference(score):
+    """Return the Elo difference matching the expected score score
+    (between 0 and 1), infinite for 0 and 1."""
+    if score <= 0.0:
+        return -math.inf
+    if score >= 1.0:
+        return math.inf
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def elo_interval(wins, draws, losses, z=1.96):
+    """Return (elo, low, high): the Elo difference estimated from the
+    results and its confidence interval (95% by default)."""
+    n = wins + draws + losses
+    if n == 0:
+        return (0.0, -math.inf, math.inf)
+    score = (wins + 0.5 * draws) / n
+    variance = (wins * (1.0 - score) ** 2 + draws * (0.5 - score) ** 2 +
+                losses * score ** 2) / n
+    margin = z * math.sqrt(variance / n)
+    return (elo_difference(score), elo_difference(score - margin),
+            elo_difference(score + margin))
+
+
+class Results:
+
+    """Results of a tournament.
+
+    Attributes:
+    names -- names of the agents
+    table -- table[i][j] is the list [wins, draws, losses] of agent i
+        against agent j, whatever the colours
+    games -- number of games recorded
+
+    """
+
+    def __init__(self, names):
+        self.names = names
+        count = len(names)
+        self.table = [[[0, 0, 0] for j in range(count)] for i in range(count)]
+        self.games = 0
+
+    def add(self, first, second, winner):
+        """Record a game between first (player 1) and second (player 2),
+        winner being the sign of the final score."""
+        self.games += 1
+        if winner > 0:
+            outcome = 0
+        elif winner == 0:
+            outcome = 1
+        else:
+            outcome = 2
+        self.table[first][second][outcome] += 1
+        self.table[second][first][2 - outcome] += 1
+
+    def get_totals(self, i):
+        """Return [wins, draws, losses] of agent i against all the others."""
+        return [sum(self.table[i][j][k] for j in range(len(self.names)))
+                for k in range(3)]
+
+    def __str__(self):
+        width = max(len(name) for name in self.names)
+        lines = ["%-*s  %5s %5s %5s  %7s  %s" %
+                 (width, "agent", "win", "draw", "loss", "elo", "95% interval")]
+        for i, name in enumerate(self.names):
+            wins, draws, losses = self.get_totals(i)
+            elo, low, high = elo_interval(wins, draws, losses)
+            lines.append("%-*s  %5d %5d %5d  %+7.1f  [%+.1f, %+.1f]" %
+                         (width, name, wins, draws, losses, elo, low, high))
+        lines.append("(elo: rating difference with the opponents met)")
+        lines.append("")
+        lines.append("Pairwise (row against column, win/draw/loss):")
+        for i, name in enumerate(self.names):
+            cells = ["%d/%d/%d" % tuple(self.table[i][j]) if i != j else "-"
+                     for j in range(len(self.names))]
+            lines.append("%-*s  %s" % (width, name, "  ".join(cells)))
+        return "\n".join(lines)
+
+
+def run_tournament(specs, games, mode="round-robin", credit=None,
+                   output=None, processes=None, callback=None):
+    """Play a tournament between the agents given by specs (see
+    game.load_agent) and return its Results.
+
+    The games (see get_pairings) are played on a pool of processes
+    (os.cpu_count() by default).  If output is a binary file, the traces of
+    the games are pickled to it one after the other as tuples
+    (first spec, second spec, trace), in the order the games end (see
+    load_traces).  callback, if given, is called with the Results after
+    each game.
+    """
+    pairings = get_pairings(len(specs), games, mode)
+    tasks = [(k, specs, i, j, credit) for k, (i, j) in enumerate(pairings)]
+    results = Results(specs)
+    with multiprocessing.Pool(processes) as pool:
+        for index, first, second, trace in \
+                pool.imap_unordered(play_game, tasks):
+            results.add(first, second, trace.winner)
+            if output is not None:
+                pickle.dump((specs[first], specs[second], trace), output)
+            if callback is not None:
+                callback(results)
+    return results
+
+
+def load_traces(f):
+    """Yield the tuples (first spec, second spec, trace) written by
+    run_tournament to file f."""
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Play a headless tournament between agents.")
+    parser.add_argument("agents", nargs="+",
+                        help="agent classes, as module:Class (for example" +
+                             " my_player:MyAgent)",
+                        metavar="AGENT")
+    parser.add_argument("-g", "--games", type=int, default=2,
+                        help="number of games per pair of agents, with" +
+                             " alternating colours (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("-m", "--mode", choices=("round-robin", "gauntlet"),
+                        default="round-robin",
+                        help="pairings: every pair of agents, or the first" +
+                             " agent against each other (default:" +
+                             " %(default)s)")
+    parser.add_argument("-t", "--time", type=float,
+                        help="set the time credit per player (default:" +
+                             " untimed games)",
+                        metavar="SECONDS")
+    parser.add_argument("-j", "--processes", type=int,
+                        default=os.cpu_count(),
+                        help="number of games played at the same time" +
+                             " (default: %(default)s)",
+                        metavar="N")
+    parser.add_argument("-w", "--write", type=argparse.FileType('wb'),
+                        help="write the traces of all the games to FILE",
+                        metavar="FILE")
+    args = parser.parse_args()
+    if len(args.agents) < 2:
+        parser.error("at least two agents are needed")
+    if args.games < 1 or args.processes < 1:
+        parser.error("the numbers of games and processes must be positive")
+
+    start = time.perf_counter()
+    total = len(get_pairings(len(args.agents), args.games, args.mode))
+
+    def progress(results):
+        elapsed = time.perf_counter() - start
+        print("%d/%d games, %.1f games/min" %
+              (results.games, total, 60.0 * results.games / elapsed),
+              flush=True)
+
+    results = run_tournament(args.agents, args.games, args.mode, args.time,
+                             args.write, args.processes, progress)
+    if args.write is not None:
+        args.write.close()
+    elapsed = time.perf_counter() - start
+    print()
+    print(results)
+    print()
+    print("%d games in %.1f s, %.1f games/min" %
+          (results.games, elapsed, 60.0 * results.games / elapsed))
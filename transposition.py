@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Transposition table for the Avalam search.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; version 2 of the License.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, see <http://www.gnu.org/licenses/>.
+
+"""
+from array import array
+
+# bound types of the stored values
+EXACT = 0
+LOWER = 1  # the value is at least the stored one (fail high)
+UPPER = 2  # the value is at most the stored one (fail low)
+
+# bytes used by an entry: key, value and packed data
+ENTRY_SIZE = 24
+
+
+class TranspositionTable:
+
+    """Fixed-size table of search results indexed by position keys.
+
+    The table is made of buckets of two entries: the first one keeps the
+    deepest result (depth-preferred), the second one always takes the new
+    result.  A position has at most one entry, updated in place; a deeper
+    result taking the first entry moves its previous occupant down to the
+    second one.  An entry stores the depth searched, the bound type, the value
+    and the code of the best action (see Layout.encode_action, None if
+    unknown).  Entries from previous searches (see new_search) are replaced
+    first.
+
+    The entries are stored in flat arrays, so that the memory used is fixed
+    by the size given at construction time.
+
+    """
+
+    def __init__(self, size_mb=16):
+        """Initialize an empty table using about size_mb megabytes."""
+        self.buckets = max(1, int(size_mb * 2 ** 20) // (2 * ENTRY_SIZE))
+        self.clear()
+
+    def clear(self):
+        """Remove all the entries and reset the statistics."""
+        size = 2 * self.buckets
+        self.keys = array("Q", bytes(8 * size))
+        self.values = array("d", bytes(8 * size))
+        self.data = array("Q", bytes(8 * size))
+        self.generation = 0
+        self.used = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def new_search(self):
+        """Mark the current entries as belonging to a previous search."""
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key):
+        """Return the entry of position key as a tuple
+        (depth, bound, value, action code), or None if it is not stored."""
+        self.probes += 1
+        index = 2 * (key % self.buckets)
+        for k in (index, index + 1):
+            if self.keys[k] == key:
+                self.hits += 1
+                data = self.data[k]
+                code = (data & 0xFFFF) - 1
+                return (data >> 18 & 0xFF, data >> 16 & 3, self.values[k],
+                        code if code >= 0 else None)
+        return None
+
+    def store(self, key, depth, bound, value, code=None):
+        """Store the result of the search of position key."""
+        self.stores += 1
+        keys = self.keys
+        index = 2 * (key % self.buckets)
+        k = index
+        if keys[index] != key:
+            data = self.data[index]
+            if keys[index] == 0 or depth >= data >> 18 & 0xFF or \
+                    data >> 26 != self.generation:
+                if keys[index] != 0:
+                    # the replaced entry moves down to the always-replace
+                    # entry, over an older result of key if any
+                    if keys[index + 1] == 0:
+                        self.used += 1
+                    keys[index + 1] = keys[index]
+                    self.values[index + 1] = self.values[index]
+                    self.data[index + 1] = data
+                elif keys[index + 1] == key:
+                    # key moves up to the depth-preferred entry
+                    keys[index + 1] = 0
+                    self.used -= 1
+            else:
+                k = index + 1
+        if keys[k] == 0:
+            self.used += 1
+        self.keys[k] = key
+        self.values[k] = value
+        self.data[k] = self.generation << 26 | min(depth, 0xFF) << 18 | \
+            bound << 16 | (0 if code is None else code + 1)
+
+    def get_hit_rate(self):
+        """Return the fraction of the probes that found an entry."""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def get_occupancy(self):
+        """Return the fraction of the entries in use."""
+        return self.used / len(self.keys)
+
+    def get_size_mb(self):
+        """Return the memory used by the entries, in megabytes."""
+        return len(self.keys) * ENTRY_SIZE / 2 ** 20
+
+    def __str__(self):
+        return "%.1f MB, %d probes, %.1f%% hits, %d stores, %.1f%% full" % \
+            (self.get_size_mb(), self.probes, 100 * self.get_hit_rate(),
+             self.stores, 100 * self.get_occupancy())